@@ -1,15 +1,22 @@
-from flask import Flask, request, abort
-import json
+import os
+import threading
+import time
+from flask import Flask, request, jsonify, g
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from key_providers import LocalKeyProvider, RemoteJWKSProvider
 
 
 app = Flask(__name__)
 
-AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
+# @TODO set AUTH0_DOMAIN and API_AUDIENCE to your domain and API audience
+AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN', 'TODO_REPLACE_WITH_YOUR_DOMAIN')
 ALGORITHMS = ['RS256']
-API_AUDIENCE = @TODO_REPLACE_WITH_YOUR_API_AUDIENCE
+API_AUDIENCE = os.environ.get('API_AUDIENCE', 'TODO_REPLACE_WITH_YOUR_API_AUDIENCE')
+# a PEM public key or JWKS file to verify tokens with, instead of the
+# Auth0 JWKS endpoint
+JWKS_FILE = os.environ.get('JWKS_FILE')
 
 
 class AuthError(Exception):
@@ -18,6 +25,42 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+def create_key_provider():
+    if JWKS_FILE:
+        return LocalKeyProvider(JWKS_FILE)
+    return RemoteJWKSProvider(
+        f'https://{AUTH0_DOMAIN}/.well-known/jwks.json').start()
+
+
+key_provider = create_key_provider()
+
+
+class LatencyStats:
+    """Count, average and maximum duration of each token verification stage"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            count, total, longest = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds,
+                                  max(longest, seconds))
+        g.setdefault('auth_timings', []).append((stage, seconds))
+
+    def stats(self):
+        with self._lock:
+            return {stage: {
+                'count': count,
+                'avg_ms': total / count * 1000,
+                'max_ms': longest * 1000
+            } for stage, (count, total, longest) in self.stages.items()}
+
+
+auth_latency = LatencyStats()
+
+
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header
     """
@@ -52,26 +95,30 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+    start = time.perf_counter()
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 401)
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = key_provider.get_key(unverified_header['kid'])
+    auth_latency.record('key_lookup', time.perf_counter() - start)
+    if rsa_key is None and not key_provider.ready:
+        raise AuthError({
+            'code': 'keys_unavailable',
+            'description': 'Signing keys are not loaded yet.'
+        }, 503)
+
     if rsa_key:
+        start = time.perf_counter()
         try:
             payload = jwt.decode(
                 token,
@@ -99,6 +146,8 @@ def verify_decode_jwt(token):
                 'code': 'invalid_header',
                 'description': 'Unable to parse authentication token.'
             }, 400)
+        finally:
+            auth_latency.record('verify', time.perf_counter() - start)
     raise AuthError({
                 'code': 'invalid_header',
                 'description': 'Unable to find the appropriate key.'
@@ -109,16 +158,39 @@ def requires_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         token = get_token_auth_header()
-        try:
-            payload = verify_decode_jwt(token)
-        except:
-            abort(401)
+        payload = verify_decode_jwt(token)
         return f(payload, *args, **kwargs)
 
     return wrapper
 
+
+@app.errorhandler(AuthError)
+def auth_error(error):
+    return jsonify({
+        'success': False,
+        'error': error.status_code,
+        'code': error.error['code'],
+        'message': error.error['description']
+    }), error.status_code
+
+
+@app.after_request
+def add_server_timing(response):
+    timings = g.get('auth_timings')
+    if timings:
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.3f}'.format(stage, seconds * 1000)
+            for stage, seconds in timings)
+    return response
+
+
 @app.route('/headers')
 @requires_auth
 def headers(payload):
     print(payload)
-    return 'Access Granted'
\ No newline at end of file
+    return 'Access Granted'
+
+
+@app.route('/metrics')
+def metrics():
+    return jsonify({'auth_latency': auth_latency.stats()})
@@ -0,0 +1,159 @@
+import base64
+import json
+import logging
+import threading
+import time
+from urllib.request import urlopen
+
+from Crypto.PublicKey import RSA
+
+logger = logging.getLogger(__name__)
+
+
+def _base64url_uint(value):
+    return base64.urlsafe_b64encode(
+        value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    ).rstrip(b'=').decode()
+
+
+def rsa_public_jwk(pem, kid=None):
+    """JWK dict of the public half of a PEM RSA key.
+
+    Built from the key numbers: the keys of python-jose-cryptodome 1.3
+    cannot be exported as a JWK.
+    """
+    key = RSA.importKey(pem)
+    return {
+        'kty': 'RSA',
+        'kid': kid,
+        'alg': 'RS256',
+        'n': _base64url_uint(key.n),
+        'e': _base64url_uint(key.e),
+    }
+
+
+class KeyProvider:
+    """Source of the public keys that sign access tokens.
+
+    get_key(kid) returns the JWK for a key id, or None if it is unknown.
+    It is called for every request and must answer from memory.
+    """
+
+    def get_key(self, kid):
+        raise NotImplementedError
+
+    @property
+    def ready(self):
+        """False until the provider has keys to hand out"""
+        return True
+
+
+class StaticKeyProvider(KeyProvider):
+    """Keys held in memory, e.g. test keys: {kid: jwk dict}"""
+
+    def __init__(self, keys):
+        self.keys = dict(keys)
+
+    def get_key(self, kid):
+        return self.keys.get(kid)
+
+
+class LocalKeyProvider(StaticKeyProvider):
+    """Keys read once from a JWKS JSON file or a PEM public key.
+
+    A PEM file holds a single key without a key id; it is registered under
+    kid, and when kid is None it is used for every token.
+    """
+
+    def __init__(self, path, kid=None):
+        with open(path) as key_file:
+            content = key_file.read()
+        if content.lstrip().startswith('-----BEGIN'):
+            super().__init__({kid: rsa_public_jwk(content, kid)})
+            self.any_kid = kid is None
+        else:
+            super().__init__(
+                {key['kid']: key for key in json.loads(content)['keys']})
+            self.any_kid = False
+
+    def get_key(self, kid):
+        if self.any_kid:
+            return self.keys[None]
+        return super().get_key(kid)
+
+
+class RemoteJWKSProvider(KeyProvider):
+    """Keys of a JWKS endpoint, kept in memory and refreshed in the background.
+
+    Requests never wait for the endpoint: start() loads the keys in a
+    background thread, which refreshes them every ttl seconds. An unknown
+    kid triggers an early refresh, at most once every min_refetch_interval
+    seconds, and is rejected until the refresh has found it. If a refresh
+    fails the previous keys stay in use.
+    """
+
+    def __init__(self, url, ttl=600, min_refetch_interval=30, timeout=5):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.loaded = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._last_forced = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.loaded.is_set()
+
+    def fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as response:
+            jwks = json.loads(response.read())
+        return {key['kid']: key for key in jwks['keys'] if 'kid' in key}
+
+    def refresh(self):
+        try:
+            self.keys = self.fetch()
+        except Exception:
+            logger.exception('Unable to refresh the JWKS from %s', self.url)
+            return False
+        self.loaded.set()
+        return True
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_forever,
+                                                daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def get_key(self, kid):
+        key = self.keys.get(kid)
+        if key is None:
+            self._request_refresh()
+        return key
+
+    def _request_refresh(self):
+        self.start()
+        with self._lock:
+            now = time.monotonic()
+            if self._last_forced is not None and \
+                    now - self._last_forced < self.min_refetch_interval:
+                return
+            self._last_forced = now
+        self._wake.set()
+
+    def _refresh_forever(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            self.refresh()
+            # retry quickly until the first load succeeds
+            self._wake.wait(self.ttl if self.ready else min(self.ttl, 5))
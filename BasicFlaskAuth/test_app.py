@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from Crypto.PublicKey import RSA
+from jose import jwt
+
+# throwaway key pair, generated for each test run and only ever used to
+# sign tokens in these tests
+TEST_KEY = RSA.generate(2048)
+TEST_PRIVATE_KEY = TEST_KEY.exportKey('PEM').decode()
+TEST_PUBLIC_KEY = TEST_KEY.publickey().exportKey('PEM')
+
+
+def write_public_key():
+    handle, path = tempfile.mkstemp(suffix='.pem')
+    with os.fdopen(handle, 'wb') as key_file:
+        key_file.write(TEST_PUBLIC_KEY)
+    return path
+
+
+# verify tokens with the test key instead of fetching Auth0's JWKS
+os.environ.setdefault('JWKS_FILE', write_public_key())
+os.environ.setdefault('AUTH0_DOMAIN', 'basic-flask-auth.test')
+os.environ.setdefault('API_AUDIENCE', 'image')
+
+import app as basic_auth
+from key_providers import (
+    LocalKeyProvider, RemoteJWKSProvider, StaticKeyProvider, rsa_public_jwk
+)
+
+
+def make_token(kid='test-key', expires_in=3600, audience=None):
+    claims = {
+        'iss': 'https://' + basic_auth.AUTH0_DOMAIN + '/',
+        'aud': audience or basic_auth.API_AUDIENCE,
+        'sub': 'auth0|tester',
+        'exp': int(time.time()) + expires_in,
+    }
+    return jwt.encode(claims, TEST_PRIVATE_KEY, algorithm='RS256',
+                      headers={'kid': kid})
+
+
+class BasicFlaskAuthTestCase(unittest.TestCase):
+    """This class represents the basic flask auth test case"""
+
+    def setUp(self):
+        self.client = basic_auth.app.test_client()
+
+    def use_provider(self, provider):
+        original = basic_auth.key_provider
+        basic_auth.key_provider = provider
+        self.addCleanup(setattr, basic_auth, 'key_provider', original)
+        return provider
+
+    def get_headers(self, token):
+        return self.client.get('/headers', headers={
+            'Authorization': 'Bearer ' + token})
+
+    def test_local_key_file(self):
+        res = self.get_headers(make_token())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, b'Access Granted')
+
+    def test_static_keys(self):
+        self.use_provider(StaticKeyProvider({
+            'test-key': rsa_public_jwk(TEST_PUBLIC_KEY, 'test-key')}))
+
+        self.assertEqual(self.get_headers(make_token()).status_code, 200)
+        res = self.get_headers(make_token(kid='other-key'))
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.get_json()['code'], 'invalid_header')
+
+    def test_errors_are_distinguished(self):
+        res = self.get_headers(make_token(expires_in=-60))
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'token_expired')
+
+        res = self.get_headers(make_token(audience='other'))
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'invalid_claims')
+
+        res = self.get_headers('not-a-token')
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.get_json()['code'], 'invalid_header')
+
+    def test_local_jwks_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as jwks_file:
+            json.dump({'keys': [rsa_public_jwk(TEST_PUBLIC_KEY, 'test-key')]},
+                      jwks_file)
+            jwks_file.flush()
+            self.use_provider(LocalKeyProvider(jwks_file.name))
+
+        self.assertEqual(self.get_headers(make_token()).status_code, 200)
+        self.assertEqual(
+            self.get_headers(make_token(kid='other-key')).status_code, 400)
+
+    def test_remote_keys_not_loaded_yet(self):
+        provider = self.use_provider(
+            RemoteJWKSProvider('http://127.0.0.1:9/.well-known/jwks.json'))
+        self.addCleanup(provider.stop)
+
+        start = time.perf_counter()
+        res = self.get_headers(make_token())
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.get_json()['code'], 'keys_unavailable')
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_latency_reported_per_stage(self):
+        res = self.get_headers(make_token())
+
+        self.assertIn('key_lookup;dur=', res.headers['Server-Timing'])
+        self.assertIn('verify;dur=', res.headers['Server-Timing'])
+        stats = self.client.get('/metrics').get_json()['auth_latency']
+        self.assertGreaterEqual(stats['verify']['count'], 1)
+        self.assertGreaterEqual(stats['key_lookup']['max_ms'],
+                                stats['key_lookup']['avg_ms'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
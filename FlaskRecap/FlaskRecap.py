@@ -1,4 +1,8 @@
-from flask import Flask, request, jsonify, abort
+import os
+import threading
+from flask import Flask, request, jsonify, abort, json
+
+from greeting_stores import MemoryGreetingStore, SQLiteGreetingStore
 
 app = Flask(__name__)
 
@@ -12,22 +16,46 @@ greetings = {
             'ja': 'こんにちは'
             }
 
+# set GREETINGS_DB to a SQLite file to share greetings between worker
+# processes and keep them across restarts
+GREETINGS_DB = os.environ.get('GREETINGS_DB')
+
+if GREETINGS_DB:
+    store = SQLiteGreetingStore(GREETINGS_DB, greetings)
+else:
+    store = MemoryGreetingStore(greetings)
+
+# (store version, serialized {'greetings': ...} body)
+greetings_body = (None, None)
+greetings_body_lock = threading.Lock()
+
+
+def all_greetings_response():
+    global greetings_body
+    version, body = greetings_body
+    if version is None or version != store.version():
+        with greetings_body_lock:
+            version, all_greetings = store.snapshot()
+            body = json.dumps({'greetings': all_greetings})
+            greetings_body = (version, body)
+    return app.response_class(body + '\n', mimetype='application/json')
+
 @app.route('/greeting', methods=['GET'])
 def greeting_all():
-    return jsonify({'greetings': greetings})
+    return all_greetings_response()
 
 @app.route('/greeting/<lang>', methods=['GET'])
 def greeting_one(lang):
     print(lang)
-    if(lang not in greetings):
+    greeting = store.get(lang)
+    if(greeting is None):
         abort(404)
-    return jsonify({'greeting': greetings[lang
-    ]})
+    return jsonify({'greeting': greeting})
 
 @app.route('/greeting', methods=['POST'])
 def greeting_add():
     info = request.get_json()
     if('lang' not in info or 'greeting' not in info):
         abort(422)
-    greetings[info['lang']] = info['greeting']
-    return jsonify({'greetings':greetings})
+    store.set(info['lang'], info['greeting'])
+    return all_greetings_response()
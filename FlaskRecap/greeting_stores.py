@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+
+
+class GreetingStore:
+    """Storage backend of the {lang: greeting} map.
+
+    Every change bumps the store version, so callers can cache anything
+    derived from snapshot() until version() changes.
+    """
+
+    def snapshot(self):
+        """Returns (version, {lang: greeting}) read at the same moment"""
+        raise NotImplementedError
+
+    def version(self):
+        raise NotImplementedError
+
+    def get(self, lang):
+        """Returns the greeting for lang, or None"""
+        raise NotImplementedError
+
+    def set(self, lang, greeting):
+        raise NotImplementedError
+
+
+class MemoryGreetingStore(GreetingStore):
+    """Greetings in a lock-protected dict, private to one process"""
+
+    def __init__(self, greetings=None):
+        self._greetings = dict(greetings or {})
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            return self._version, dict(self._greetings)
+
+    def version(self):
+        return self._version
+
+    def get(self, lang):
+        return self._greetings.get(lang)
+
+    def set(self, lang, greeting):
+        with self._lock:
+            self._greetings[lang] = greeting
+            self._version += 1
+
+
+class SQLiteGreetingStore(GreetingStore):
+    """Greetings in a SQLite file, shared by every process that opens it.
+
+    Each thread gets its own connection. The version lives in the database
+    too, so a write made by one gunicorn worker invalidates the caches of
+    all of them. The greetings given are only stored if the file is new.
+    """
+
+    def __init__(self, path, greetings=None, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS greetings '
+                '(lang TEXT PRIMARY KEY, greeting TEXT NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS greetings_version '
+                '(id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER)')
+            created = connection.execute(
+                'INSERT OR IGNORE INTO greetings_version VALUES (0, 0)'
+            ).rowcount
+            if created:
+                connection.executemany(
+                    'INSERT INTO greetings VALUES (?, ?)',
+                    (greetings or {}).items())
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode = WAL')
+            self._local.connection = connection
+        return connection
+
+    def snapshot(self):
+        connection = self._connection()
+        # one read transaction, so the version matches the rows
+        with connection:
+            connection.execute('BEGIN')
+            version = connection.execute(
+                'SELECT version FROM greetings_version').fetchone()[0]
+            greetings = dict(connection.execute(
+                'SELECT lang, greeting FROM greetings ORDER BY rowid'))
+        return version, greetings
+
+    def version(self):
+        return self._connection().execute(
+            'SELECT version FROM greetings_version').fetchone()[0]
+
+    def get(self, lang):
+        row = self._connection().execute(
+            'SELECT greeting FROM greetings WHERE lang = ?', (lang,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, lang, greeting):
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT INTO greetings VALUES (?, ?) ON CONFLICT (lang) '
+                'DO UPDATE SET greeting = excluded.greeting',
+                (lang, greeting))
+            connection.execute(
+                'UPDATE greetings_version SET version = version + 1')
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import FlaskRecap
+from greeting_stores import MemoryGreetingStore, SQLiteGreetingStore
+
+
+class GreetingTestCase(unittest.TestCase):
+    """This class represents the greeting endpoints test case"""
+
+    def setUp(self):
+        self.store = self.create_store()
+        self.addCleanup(setattr, FlaskRecap, 'store', FlaskRecap.store)
+        FlaskRecap.store = self.store
+        self.addCleanup(setattr, FlaskRecap, 'greetings_body', (None, None))
+        FlaskRecap.greetings_body = (None, None)
+        self.client = FlaskRecap.app.test_client()
+
+    def create_store(self):
+        return MemoryGreetingStore(FlaskRecap.greetings)
+
+    def test_get_greetings(self):
+        res = self.client.get('/greeting')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['greetings']['fi'], 'Hei')
+        self.assertEqual(self.client.get('/greeting/es').get_json(),
+                         {'greeting': 'Hola'})
+        self.assertEqual(self.client.get('/greeting/xx').status_code, 404)
+
+    def test_add_greeting(self):
+        self.client.get('/greeting')
+        res = self.client.post('/greeting',
+                               json={'lang': 'de', 'greeting': 'Hallo'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['greetings']['de'], 'Hallo')
+        self.assertEqual(
+            self.client.get('/greeting').get_json()['greetings']['de'],
+            'Hallo')
+        self.assertEqual(self.client.post('/greeting', json={}).status_code,
+                         422)
+
+    def test_body_serialized_once_per_version(self):
+        first = self.client.get('/greeting')
+        body = FlaskRecap.greetings_body
+        second = self.client.get('/greeting')
+
+        self.assertIs(FlaskRecap.greetings_body, body)
+        self.assertEqual(first.data, second.data)
+
+        self.store.set('en', 'hi')
+        self.assertNotEqual(self.client.get('/greeting').data, first.data)
+
+    def test_concurrent_writers(self):
+        def writer(thread_id):
+            for i in range(25):
+                self.store.set('{}-{}'.format(thread_id, i), 'hello')
+
+        threads = [threading.Thread(target=writer, args=(thread_id,))
+                   for thread_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        version, greetings = self.store.snapshot()
+        self.assertEqual(len(greetings), len(FlaskRecap.greetings) + 200)
+        self.assertEqual(version, 200)
+
+
+class SQLiteGreetingTestCase(GreetingTestCase):
+    """Runs the greeting tests against the shared SQLite store"""
+
+    def create_store(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'greetings.db')
+        return SQLiteGreetingStore(self.path, FlaskRecap.greetings)
+
+    def test_shared_between_stores(self):
+        # e.g. two gunicorn workers, or a restarted server
+        other = SQLiteGreetingStore(self.path, {'en': 'ignored'})
+        other.set('de', 'Hallo')
+
+        self.assertEqual(self.client.get('/greeting/de').get_json(),
+                         {'greeting': 'Hallo'})
+        greetings = self.client.get('/greeting').get_json()['greetings']
+        self.assertEqual(greetings['de'], 'Hallo')
+        self.assertEqual(greetings['en'], 'hello')
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,12 @@
 #----------------------------------------------------------------------------#
 
 import json
+import threading
+import click
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, stream_with_context, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -14,6 +17,10 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from datetime import datetime
+from collections import Counter
+from functools import lru_cache
+from itertools import groupby
+from db_pool import pool_stats
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -29,8 +36,16 @@ migrate = Migrate(app, db)
 # Models.
 #----------------------------------------------------------------------------#
 
+# Postgres stores genres as a native array; other backends (SQLite in tests) as JSON.
+GENRES_TYPE = db.ARRAY(db.String).with_variant(db.JSON, 'sqlite')
+
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venues_city_state', 'city', 'state'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -38,16 +53,22 @@ class Venue(db.Model):
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(GENRES_TYPE, nullable=False)
     website = db.Column(db.String(120), nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
-    shows = db.relationship('Show', backref="venue", lazy=True)
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    num_past_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref="venue", lazy=True, cascade='save-update, merge, delete')
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
@@ -55,15 +76,21 @@ class Artist(db.Model):
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
     website = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(GENRES_TYPE, nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
-    shows = db.relationship('Show', backref="artist", lazy=True)
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    num_past_shows = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref="artist", lazy=True, cascade='save-update, merge, delete')
 
 class Show(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     start_time = db.Column(db.DateTime, nullable=False)
@@ -74,16 +101,201 @@ class Show(db.Model):
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+DATETIME_LOCALE = babel.Locale.parse('en')
+
+@lru_cache(maxsize=None)
+def compile_datetime_format(format):
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+  # datetime objects are formatted as is, only strings need parsing
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  return compile_datetime_format(format).apply(value, DATETIME_LOCALE)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def stream_template(template_name, **context):
+  app.update_template_context(context)
+  return app.jinja_env.get_template(template_name).stream(context)
+
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
+
+def search_by_name(model, search_term):
+  '''
+  Case-insensitive substring search on model.name. On Postgres the ILIKE is
+  served by the pg_trgm GIN index and matches are ranked by similarity to
+  the search term; other backends (SQLite) fall back to ordering by name.
+  '''
+  query = model.query.filter(model.name.ilike('%' + search_term + '%'))
+  if search_term and db.engine.dialect.name == 'postgresql':
+    query = query.order_by(db.func.similarity(model.name, search_term).desc(), model.name)
+  else:
+    query = query.order_by(model.name)
+  return query.all()
+
+def show_page(after=None, limit=None):
+  '''
+  Shows ordered by (start_time, id) with their venue and artist joined into
+  the same query. after is the (start_time, id) keyset of the last show on
+  the previous page.
+  '''
+  query = Show.query.options(db.joinedload(Show.venue), db.joinedload(Show.artist)).\
+    order_by(Show.start_time, Show.id)
+  if after is not None:
+    start_time, show_id = after
+    query = query.filter(db.or_(
+      Show.start_time > start_time,
+      db.and_(Show.start_time == start_time, Show.id > show_id)))
+  if limit is not None:
+    query = query.limit(limit)
+  return query
+
+def update_show_counters(shows, delta, now=None):
+  '''
+  Adds delta to the upcoming or past show counter of every show's venue and
+  artist. Runs as in-database increments inside the caller's transaction.
+  '''
+  if now is None:
+    now = datetime.now()
+
+  for model, key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+    deltas = Counter()
+    for show in shows:
+      column = 'num_upcoming_shows' if show.start_time > now else 'num_past_shows'
+      deltas[getattr(show, key), column] += delta
+    for (id, column), count in deltas.items():
+      model.query.filter(model.id == id).\
+        update({column: getattr(model, column) + count}, synchronize_session=False)
+
+def reconcile_show_counters(now=None):
+  '''
+  Rebuilds the venue and artist show counters from the shows table, which
+  also moves shows that have started since the last run from upcoming to
+  past. Returns the drift found as (table, id, column, stored, actual).
+  '''
+  if now is None:
+    now = datetime.now()
+
+  drift = []
+  for model, key in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    actual = {}
+    for id, upcoming, past in db.session.query(key,
+        db.func.sum(db.case([(Show.start_time > now, 1)], else_=0)),
+        db.func.sum(db.case([(Show.start_time <= now, 1)], else_=0))).group_by(key):
+      actual[id] = {'num_upcoming_shows': upcoming, 'num_past_shows': past}
+
+    for id, num_upcoming_shows, num_past_shows in db.session.query(
+        model.id, model.num_upcoming_shows, model.num_past_shows):
+      stored = {'num_upcoming_shows': num_upcoming_shows, 'num_past_shows': num_past_shows}
+      counts = actual.get(id, {'num_upcoming_shows': 0, 'num_past_shows': 0})
+      if stored == counts:
+        continue
+      for column in sorted(counts):
+        if stored[column] != counts[column]:
+          drift.append((model.__tablename__, id, column, stored[column], counts[column]))
+      model.query.filter(model.id == id).update(counts, synchronize_session=False)
+
+  db.session.commit()
+  return drift
+
+def refresh_show_counters():
+  '''
+  One scheduled counter rebuild: reconciles the show counters in its own
+  app context and logs, rather than raises, any failure.
+  '''
+  with app.app_context():
+    try:
+      drift = reconcile_show_counters()
+      if drift:
+        app.logger.info('show counters refreshed, %d corrected', len(drift))
+    except Exception:
+      db.session.rollback()
+      app.logger.exception('Unable to refresh the show counters')
+    finally:
+      db.session.remove()
+
+class ShowCounterRefresher(object):
+  '''
+  Daemon thread running refresh_show_counters() every interval seconds, so
+  the upcoming counts on the listing and search pages are at most interval
+  seconds behind the shows. start() is idempotent.
+  '''
+
+  def __init__(self, interval):
+    self.interval = interval
+    self._stop = threading.Event()
+    self._lock = threading.Lock()
+    self._thread = None
+
+  def start(self):
+    if self._thread is not None:
+      return self
+    with self._lock:
+      if self._thread is None and self.interval > 0:
+        self._thread = threading.Thread(
+          target=self._run, name='show-counters', daemon=True)
+        self._thread.start()
+    return self
+
+  def stop(self):
+    self._stop.set()
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      refresh_show_counters()
+
+show_counter_refresher = ShowCounterRefresher(app.config['SHOW_COUNTS_REFRESH_INTERVAL'])
+
+@app.before_request
+def start_show_counter_refresher():
+  # started by the first request of each worker, not by `flask` commands
+  show_counter_refresher.start()
+
+def split_shows(rows, now, past_limit=None):
+  '''
+  Splits (venue or artist, show) rows ordered by start_time into past and
+  upcoming shows against a single captured timestamp. Past shows come most
+  recent first and are capped at past_limit when given; the total number of
+  past shows is returned alongside.
+  '''
+  past_shows = []
+  upcoming_shows = []
+  for row in rows:
+    if row[1].start_time > now:
+      upcoming_shows.append(row)
+    else:
+      past_shows.append(row)
+  past_shows.reverse()
+  return past_shows[:past_limit], upcoming_shows, len(past_shows)
+
+def venue_areas():
+  '''
+  Builds the city/state -> venues -> upcoming show count tree for /venues
+  from a single query over venues, reading the materialized show counters.
+  '''
+  rows = db.session.query(Venue.city, Venue.state, Venue.id, Venue.name, Venue.num_upcoming_shows).\
+    order_by(Venue.city, Venue.state, Venue.name, Venue.id).all()
+
+  areas = []
+  for (city, state), venues in groupby(rows, key=lambda row: (row[0], row[1])):
+    areas.append({
+        'city': city,
+        'state': state,
+        'venues': [{
+            'id': venue_id,
+            'name': name,
+            'num_upcoming_shows': num_upcoming_shows
+        } for _, _, venue_id, name, num_upcoming_shows in venues]
+    })
+  return areas
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -98,33 +310,19 @@ def index():
 
 @app.route('/venues')
 def venues():
-  locals = []
-  venues = Venue.query.all()
-  places = Venue.query.distinct(Venue.city, Venue.state).all()
-  for place in places:
-    locals.append({
-        'city': place.city,
-        'state': place.state,
-        'venues': [{
-            'id': venue.id,
-            'name': venue.name,
-            'num_upcoming_shows': Show.query.filter(Show.start_time>datetime.now(), Show.venue_id == venue.id).count()
-        } for venue in venues if
-            venue.city == place.city and venue.state == place.state]
-    })
-  return render_template('pages/venues.html', areas=locals);
+  return render_template('pages/venues.html', areas=venue_areas());
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.ilike( '%' + search_term + '%')).all()
+  venues = search_by_name(Venue, search_term)
 
   response={
     "count": len(venues),
     "data": [{
       "id": venue.id,
       "name": venue.name,
-      "num_upcoming_shows": Show.query.filter(Show.start_time>datetime.now(), Show.venue_id == venue.id).count(),
+      "num_upcoming_shows": venue.num_upcoming_shows,
     } for venue in venues]
   }
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
@@ -133,11 +331,10 @@ def search_venues():
 def show_venue(venue_id):
   venue = Venue.query.get_or_404(venue_id)
 
-  past_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-  filter(Show.venue_id == venue_id, Show.artist_id == Artist.id, Show.start_time <= datetime.now()).all()
-
-  upcoming_shows = db.session.query(Artist, Show).join(Show).join(Venue).\
-  filter(Show.venue_id == venue_id, Show.artist_id == Artist.id, Show.start_time > datetime.now()).all()
+  shows = db.session.query(Artist, Show).join(Show, Show.artist_id == Artist.id).\
+  filter(Show.venue_id == venue_id).order_by(Show.start_time, Show.id).all()
+  past_shows, upcoming_shows, past_shows_count = split_shows(
+    shows, datetime.now(), app.config['PAST_SHOWS_LIMIT'])
 
   data={
     "id" : venue.id,
@@ -156,15 +353,15 @@ def show_venue(venue_id):
       "artist_id": artist.id,
       "artist_name": artist.name,
       "artist_image_link": artist.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
+      "start_time": show.start_time
     } for artist, show in past_shows],
     "upcoming_shows": [{
       "artist_id": artist.id,
       "artist_name": artist.name,
       "artist_image_link": artist.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
+      "start_time": show.start_time
     } for artist, show in upcoming_shows],
-    "past_shows_count": len(past_shows),
+    "past_shows_count": past_shows_count,
     "upcoming_shows_count": len(upcoming_shows),
   }
   return render_template('pages/show_venue.html', venue=data)
@@ -199,6 +396,7 @@ def delete_venue(venue_id):
   try:
     venue = Venue.query.get(venue_id)
     name = venue.name
+    update_show_counters(venue.shows, -1)
     db.session.delete(venue)
     db.session.commit()
     flash('Venue ' + name + ' was successfully deleted!')
@@ -254,14 +452,14 @@ def artists():
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike( '%' + search_term + '%')).all()
+  artists = search_by_name(Artist, search_term)
 
   response={
     "count": len(artists),
     "data": [{
       "id": artist.id,
       "name": artist.name,
-      "num_upcoming_shows": Show.query.filter(Show.start_time>datetime.now(), Show.artist_id == artist.id).count(),
+      "num_upcoming_shows": artist.num_upcoming_shows,
     } for artist in artists]
   }
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
@@ -270,11 +468,10 @@ def search_artists():
 def show_artist(artist_id):
   artist = Artist.query.get_or_404(artist_id)
 
-  past_shows = db.session.query(Venue, Show).join(Show).join(Artist).\
-  filter(Show.venue_id == Venue.id, Show.artist_id == artist_id, Show.start_time <= datetime.now()).all()
-
-  upcoming_shows = db.session.query(Venue, Show).join(Show).join(Artist).\
-  filter(Show.venue_id == Venue.id, Show.artist_id == artist_id, Show.start_time > datetime.now()).all()
+  shows = db.session.query(Venue, Show).join(Show, Show.venue_id == Venue.id).\
+  filter(Show.artist_id == artist_id).order_by(Show.start_time, Show.id).all()
+  past_shows, upcoming_shows, past_shows_count = split_shows(
+    shows, datetime.now(), app.config['PAST_SHOWS_LIMIT'])
 
   data={
     "id" : artist.id,
@@ -292,15 +489,15 @@ def show_artist(artist_id):
       "venue_id": venue.id,
       "venue_name": venue.name,
       "venue_image_link": venue.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
+      "start_time": show.start_time
     } for venue, show in past_shows],
     "upcoming_shows": [{
       "venue_id": venue.id,
       "venue_name": venue.name,
       "venue_image_link": venue.image_link,
-      "start_time": show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
+      "start_time": show.start_time
     } for venue, show in upcoming_shows],
-    "past_shows_count": len(past_shows),
+    "past_shows_count": past_shows_count,
     "upcoming_shows_count": len(upcoming_shows),
   }
 
@@ -365,6 +562,7 @@ def delete_artist(artist_id):
   try:
     artist = Artist.query.get(artist_id)
     name = artist.name
+    update_show_counters(artist.shows, -1)
     db.session.delete(artist)
     db.session.commit()
     flash('Artist ' + name + ' was successfully deleted!')
@@ -382,20 +580,55 @@ def delete_artist(artist_id):
 #  Shows
 #  ----------------------------------------------------------------
 
+def format_show(show):
+  return {
+      'venue_id': show.venue_id,
+      'venue_name': show.venue.name,
+      'artist_id': show.artist_id,
+      'artist_name': show.artist.name,
+      'artist_image_link' : show.artist.image_link,
+      'start_time': show.start_time
+  }
+
+def encode_show_cursor(show):
+  return '{}_{}'.format(show.start_time.isoformat(), show.id)
+
+def decode_show_cursor(cursor):
+  start_time, show_id = cursor.rsplit('_', 1)
+  return datetime.fromisoformat(start_time), int(show_id)
+
 @app.route('/shows')
 def shows():
-  data = []
-  shows = Show.query.all()
-  for show in shows:
-    data.append({
-        'venue_id': show.venue_id,
-        'venue_name': show.venue.name,
-        'artist_id': show.artist_id,
-        'artist_name': show.artist.name,
-        'artist_image_link' : show.artist.image_link,
-        'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M:%S")
-    })
-  return render_template('pages/shows.html', shows=data)
+  limit = app.config['SHOWS_PER_PAGE']
+  after = None
+  if request.args.get('after'):
+    try:
+      after = decode_show_cursor(request.args['after'])
+    except ValueError:
+      abort(400)
+
+  page = show_page(after, limit).all()
+  next_cursor = encode_show_cursor(page[-1]) if len(page) == limit else None
+  return render_template('pages/shows.html', shows=[format_show(show) for show in page],
+    next_cursor=next_cursor)
+
+@app.route('/shows/export')
+def export_shows():
+  # streams every show page by page so large listings never sit in memory
+  limit = app.config['SHOWS_PER_PAGE']
+
+  def generate_shows():
+    after = None
+    while True:
+      page = show_page(after, limit).all()
+      for show in page:
+        yield format_show(show)
+      if len(page) < limit:
+        break
+      after = (page[-1].start_time, page[-1].id)
+
+  return Response(stream_with_context(
+    stream_template('pages/shows.html', shows=generate_shows(), next_cursor=None)))
 
 @app.route('/shows/create')
 def create_shows():
@@ -409,6 +642,7 @@ def create_show_submission():
     form = ShowForm(request.form)
     form.populate_obj(show)
     db.session.add(show)
+    update_show_counters([show], 1)
     db.session.commit()
     flash('Show was successfully listed!')
   except:
@@ -418,6 +652,13 @@ def create_show_submission():
     db.session.close()
   return render_template('pages/home.html')
 
+#  Metrics
+#  ----------------------------------------------------------------
+
+@app.route('/metrics')
+def metrics():
+  return jsonify({'db_pool': pool_stats(db.engine)})
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -437,6 +678,18 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('reconcile-show-counts')
+def reconcile_show_counts_command():
+  '''Rebuild the venue and artist show counters and report any drift.'''
+  drift = reconcile_show_counters()
+  for table, id, column, stored, actual in drift:
+    click.echo('{} {} {}: {} -> {}'.format(table, id, column, stored, actual))
+  click.echo('{} counter(s) corrected'.format(len(drift)))
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,50 @@
+'''
+Micro-benchmarks for Fyyur hot paths.
+
+Run all of them with `python benchmarks.py`, or a single one by name,
+e.g. `python benchmarks.py format_datetime`.
+'''
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+from app import format_datetime
+
+
+def legacy_format_datetime(value, format='medium'):
+  # format_datetime as it was before datetime objects and compiled patterns
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def bench_format_datetime(rows=10000):
+  start = datetime(2035, 4, 1, 20)
+  values = [start + timedelta(hours=i) for i in range(rows)]
+  strings = [value.strftime("%m/%d/%Y, %H:%M:%S") for value in values]
+
+  old = min(timeit.repeat(
+    lambda: [legacy_format_datetime(value, 'full') for value in strings],
+    number=1, repeat=3))
+  new = min(timeit.repeat(
+    lambda: [format_datetime(value, 'full') for value in values],
+    number=1, repeat=3))
+
+  print('format_datetime over {} rows'.format(rows))
+  print('  old: {:8.2f} us/call'.format(old / rows * 1e6))
+  print('  new: {:8.2f} us/call ({:.1f}x)'.format(new / rows * 1e6, old / new))
+
+
+BENCHMARKS = {
+  'format_datetime': bench_format_datetime,
+}
+
+if __name__ == '__main__':
+  for name in sys.argv[1:] or BENCHMARKS:
+    BENCHMARKS[name]()
@@ -0,0 +1,37 @@
+"""add materialized show counters to venues and artists
+
+Revision ID: c48e2f90d1a6
+Revises: 9d3e6b1a4f07
+Create Date: 2026-10-18 11:58:22.304716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c48e2f90d1a6'
+down_revision = '9d3e6b1a4f07'
+branch_labels = None
+depends_on = None
+
+BACKFILL = '''
+UPDATE {table} SET
+  num_upcoming_shows = (SELECT count(*) FROM shows
+    WHERE shows.{key} = {table}.id AND shows.start_time > CURRENT_TIMESTAMP),
+  num_past_shows = (SELECT count(*) FROM shows
+    WHERE shows.{key} = {table}.id AND shows.start_time <= CURRENT_TIMESTAMP)
+'''
+
+
+def upgrade():
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.add_column(table, sa.Column('num_upcoming_shows', sa.Integer(), server_default='0', nullable=False))
+        op.add_column(table, sa.Column('num_past_shows', sa.Integer(), server_default='0', nullable=False))
+        op.execute(BACKFILL.format(table=table, key=key))
+
+
+def downgrade():
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'num_past_shows')
+        op.drop_column(table, 'num_upcoming_shows')
@@ -0,0 +1,428 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+
+# run against an in-memory SQLite database unless told otherwise
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+# counters are refreshed explicitly by the tests
+os.environ.setdefault('SHOW_COUNTS_REFRESH_INTERVAL', '0')
+
+import babel.dates
+from sqlalchemy import create_engine, event
+
+from app import (
+    app, db, Venue, Artist, Show, ShowCounterRefresher, format_datetime,
+    reconcile_show_counters, refresh_show_counters, search_by_name,
+    show_page, update_show_counters, venue_areas
+)
+from db_pool import GaugedQueuePool, engine_options, pool_stats
+
+
+class QueryCounter(object):
+    """Counts the SQL statements executed while the context is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self.callback)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, 'before_cursor_execute', self.callback)
+
+    def callback(self, conn, cursor, statement, parameters, *args):
+        self.count += 1
+        self.statements.append((statement, parameters))
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_venue(self, name, city='San Francisco', state='CA'):
+        venue = Venue(
+            name=name, city=city, state=state, address='1015 Folsom Street',
+            phone='123-123-1234', genres=['Jazz'], website='https://x.com',
+            image_link='https://x.com/img.png', facebook_link='https://x.com',
+        )
+        db.session.add(venue)
+        db.session.flush()
+        return venue
+
+    def add_artist(self, name, city='San Francisco', state='CA'):
+        artist = Artist(
+            name=name, city=city, state=state, phone='326-123-5000',
+            genres=['Jazz'], website='https://x.com',
+            image_link='https://x.com/img.png', facebook_link='https://x.com',
+        )
+        db.session.add(artist)
+        db.session.flush()
+        return artist
+
+    def add_show(self, venue, artist, start_time):
+        show = Show(venue_id=venue.id, artist_id=artist.id,
+                    start_time=start_time)
+        db.session.add(show)
+        db.session.flush()
+        update_show_counters([show], 1)
+        return show
+
+    def seed_venues(self, num_venues):
+        artist = self.add_artist('Guns N Petals')
+        tomorrow = datetime.now() + timedelta(days=1)
+        yesterday = datetime.now() - timedelta(days=1)
+        for i in range(num_venues):
+            city, state = [('San Francisco', 'CA'), ('New York', 'NY')][i % 2]
+            venue = self.add_venue('Venue {}'.format(i), city, state)
+            self.add_show(venue, artist, tomorrow)
+            self.add_show(venue, artist, yesterday)
+        db.session.commit()
+
+    def test_venue_areas(self):
+        self.seed_venues(3)
+        areas = venue_areas()
+
+        self.assertEqual([(a['city'], a['state']) for a in areas],
+                         [('New York', 'NY'), ('San Francisco', 'CA')])
+        self.assertEqual(
+            [v['name'] for v in areas[1]['venues']], ['Venue 0', 'Venue 2'])
+        for area in areas:
+            for venue in area['venues']:
+                self.assertEqual(venue['num_upcoming_shows'], 1)
+
+    def test_venue_areas_without_shows(self):
+        self.add_venue('The Dueling Pianos Bar', 'New York', 'NY')
+        db.session.commit()
+        areas = venue_areas()
+
+        self.assertEqual(len(areas), 1)
+        self.assertEqual(areas[0]['venues'][0]['num_upcoming_shows'], 0)
+
+    def test_venue_areas_constant_number_of_queries(self):
+        self.seed_venues(2)
+        with QueryCounter() as few:
+            venue_areas()
+        db.session.remove()
+
+        self.seed_venues(50)
+        with QueryCounter() as many:
+            venue_areas()
+
+        self.assertEqual(few.count, 1)
+        self.assertEqual(many.count, few.count)
+
+    def test_create_show_updates_counters(self):
+        venue = self.add_venue('The Musical Hop')
+        artist = self.add_artist('Guns N Petals')
+        db.session.commit()
+        venue_id, artist_id = venue.id, artist.id
+
+        res = self.client().post('/shows/create', data={
+            'venue_id': venue_id,
+            'artist_id': artist_id,
+            'start_time': '2035-04-01 20:00:00',
+        })
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Show was successfully listed!', res.data)
+        self.assertEqual(Venue.query.get(venue_id).num_upcoming_shows, 1)
+        self.assertEqual(Artist.query.get(artist_id).num_upcoming_shows, 1)
+        self.assertEqual(reconcile_show_counters(), [])
+
+    def test_delete_venue_updates_artist_counters(self):
+        self.seed_venues(2)
+        venue = Venue.query.first()
+        artist_id = Artist.query.first().id
+
+        res = self.client().delete('/venues/{}'.format(venue.id))
+
+        self.assertEqual(res.status_code, 200)
+        artist = Artist.query.get(artist_id)
+        self.assertEqual(artist.num_upcoming_shows, 1)
+        self.assertEqual(artist.num_past_shows, 1)
+        self.assertEqual(Show.query.count(), 2)
+        self.assertEqual(reconcile_show_counters(), [])
+
+    def test_reconcile_show_counters(self):
+        self.seed_venues(2)
+        venue = Venue.query.first()
+        venue.num_upcoming_shows = 5
+        db.session.commit()
+
+        # a day later the upcoming shows have all started
+        drift = reconcile_show_counters(datetime.now() + timedelta(days=2))
+
+        self.assertIn(
+            ('venues', venue.id, 'num_upcoming_shows', 5, 0), drift)
+        self.assertIn(('venues', venue.id, 'num_past_shows', 1, 2), drift)
+        self.assertEqual(len(drift), 6)
+        self.assertEqual(Venue.query.get(venue.id).num_past_shows, 2)
+
+    def test_reconcile_show_counts_command(self):
+        self.seed_venues(1)
+        Artist.query.update({'num_past_shows': 3})
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(
+            args=['reconcile-show-counts'])
+
+        self.assertIn('artists 1 num_past_shows: 3 -> 1', result.output)
+        self.assertIn('1 counter(s) corrected', result.output)
+
+    def test_refresh_moves_started_shows_to_past(self):
+        venue = self.add_venue('The Musical Hop')
+        artist = self.add_artist('Guns N Petals')
+        show = self.add_show(venue, artist, datetime.now() + timedelta(days=1))
+        db.session.commit()
+        venue_id = venue.id
+
+        # the show has started since it was created
+        show.start_time = datetime.now() - timedelta(minutes=1)
+        db.session.commit()
+        refresh_show_counters()
+
+        self.assertEqual(venue_areas()[0]['venues'][0]['num_upcoming_shows'], 0)
+        self.assertEqual(Venue.query.get(venue_id).num_past_shows, 1)
+
+    def test_refresher_disabled_without_interval(self):
+        refresher = ShowCounterRefresher(0).start()
+
+        self.assertIsNone(refresher._thread)
+
+    def test_search_venues_constant_number_of_queries(self):
+        self.seed_venues(2)
+        with QueryCounter() as few:
+            self.client().post('/venues/search', data={'search_term': 'venue'})
+
+        self.seed_venues(50)
+        with QueryCounter() as many:
+            res = self.client().post('/venues/search',
+                                     data={'search_term': 'venue'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'search results for "venue": 52', res.data)
+        self.assertEqual(many.count, few.count)
+
+    def test_search_artists_single_query(self):
+        self.seed_venues(4)
+        with QueryCounter() as counter:
+            res = self.client().post('/artists/search',
+                                     data={'search_term': 'petals'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Guns N Petals', res.data)
+        self.assertEqual(counter.count, 1)
+
+    def test_search_by_name(self):
+        self.add_artist('The Wild Sax Band')
+        self.add_artist('Guns N Petals')
+        self.add_artist('Matt Quevedo')
+        db.session.commit()
+
+        artists = search_by_name(Artist, 'A')
+
+        self.assertEqual([artist.name for artist in artists],
+                         ['Guns N Petals', 'Matt Quevedo', 'The Wild Sax Band'])
+        self.assertEqual(search_by_name(Artist, 'xyz'), [])
+
+    def test_show_page_keyset(self):
+        self.seed_venues(5)
+        pages = []
+        after = None
+        while True:
+            with QueryCounter() as counter:
+                page = show_page(after, limit=3).all()
+                names = [(show.venue.name, show.artist.name) for show in page]
+            self.assertEqual(counter.count, 1)
+            pages.append(page)
+            if len(page) < 3:
+                break
+            after = (page[-1].start_time, page[-1].id)
+
+        shows = [show for page in pages for show in page]
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(len(set(show.id for show in shows)), 10)
+        self.assertEqual(
+            shows, sorted(shows, key=lambda show: (show.start_time, show.id)))
+
+    def test_get_shows_paginated(self):
+        app.config['SHOWS_PER_PAGE'] = 3
+        self.addCleanup(app.config.__setitem__, 'SHOWS_PER_PAGE', 30)
+        self.seed_venues(2)
+
+        res = self.client().get('/shows')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data.count(b'tile-show'), 3)
+        self.assertIn(b'/shows?after=', res.data)
+
+        last = Show.query.order_by(Show.start_time, Show.id)[2]
+        res = self.client().get('/shows', query_string={
+            'after': '{}_{}'.format(last.start_time.isoformat(), last.id)})
+        self.assertEqual(res.data.count(b'tile-show'), 1)
+        self.assertNotIn(b'/shows?after=', res.data)
+
+    def test_get_shows_invalid_cursor(self):
+        res = self.client().get('/shows?after=yesterday')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_export_shows_streams_every_show(self):
+        app.config['SHOWS_PER_PAGE'] = 3
+        self.addCleanup(app.config.__setitem__, 'SHOWS_PER_PAGE', 30)
+        self.seed_venues(4)
+
+        res = self.client().get('/shows/export')
+
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.get_data().count(b'tile-show'), 8)
+
+    def test_show_venue_single_query_for_shows(self):
+        venue = self.add_venue('The Musical Hop')
+        artist = self.add_artist('Guns N Petals')
+        for days in (-3, -2, -1, 1, 2):
+            self.add_show(venue, artist, datetime.now() + timedelta(days=days))
+        db.session.commit()
+        venue_id = venue.id
+        db.session.remove()
+
+        with QueryCounter() as counter:
+            res = self.client().get('/venues/{}'.format(venue_id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'2 Upcoming Shows', res.data)
+        self.assertIn(b'3 Past Shows', res.data)
+        self.assertEqual(counter.count, 2)
+
+    def test_show_artist_caps_past_shows(self):
+        app.config['PAST_SHOWS_LIMIT'] = 2
+        self.addCleanup(app.config.__setitem__, 'PAST_SHOWS_LIMIT', None)
+        venue = self.add_venue('The Musical Hop')
+        artist = self.add_artist('Guns N Petals')
+        for days in (-3, -2, -1, 1):
+            self.add_show(venue, artist, datetime.now() + timedelta(days=days))
+        db.session.commit()
+
+        res = self.client().get('/artists/{}'.format(artist.id))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'3 Past Shows', res.data)
+        self.assertEqual(res.data.count(b'tile-show'), 3)
+
+    def query_plan(self, statement, parameters):
+        rows = db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        return ' '.join(row[-1] for row in rows)
+
+    def test_hot_queries_use_indexes(self):
+        if db.engine.dialect.name != 'sqlite':
+            self.skipTest('query plans are checked on SQLite only')
+        self.seed_venues(2)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+
+        with QueryCounter() as counter:
+            venue_areas()
+            reconcile_show_counters()
+            self.client().get('/venues/{}'.format(venue.id))
+            self.client().get('/artists/{}'.format(artist.id))
+        plans = [self.query_plan(statement, parameters)
+                 for statement, parameters in counter.statements
+                 if statement.startswith('SELECT')]
+
+        self.assertEqual(len(plans), 8)
+        # /venues listing
+        self.assertIn('ix_venues_city_state', plans[0])
+        # counter reconciliation, grouped by venue then by artist
+        self.assertIn('ix_shows_venue_id_start_time', plans[1])
+        self.assertIn('ix_shows_artist_id_start_time', plans[3])
+        # shows on the venue and artist detail pages
+        self.assertIn('ix_shows_venue_id_start_time', plans[6])
+        self.assertIn('ix_shows_artist_id_start_time', plans[7])
+
+    def test_get_venues(self):
+        self.seed_venues(2)
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'Venue 1', res.data)
+
+    def test_format_datetime(self):
+        value = datetime(2035, 4, 1, 20, 30)
+
+        self.assertEqual(format_datetime(value, 'full'),
+                         'Sunday April, 1, 2035 at 8:30PM')
+        self.assertEqual(format_datetime(value), babel.dates.format_datetime(
+            value, 'EE MM, dd, y h:mma', locale='en'))
+        self.assertEqual(format_datetime('2035-04-01T20:30:00', 'full'),
+                         format_datetime(value, 'full'))
+        self.assertEqual(format_datetime(value, 'y'), '2035')
+
+
+class DBPoolTestCase(unittest.TestCase):
+    """This class represents the connection pool settings test case"""
+
+    def test_engine_options_from_environment(self):
+        options = engine_options('postgresql://localhost/fyyur', {
+            'DB_POOL_SIZE': '20',
+            'DB_MAX_OVERFLOW': '0',
+            'DB_POOL_RECYCLE': '300',
+            'DB_POOL_PRE_PING': 'false',
+        })
+
+        self.assertIs(options['poolclass'], GaugedQueuePool)
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_recycle'], 300)
+        self.assertEqual(options['pool_timeout'], 30)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_sqlite_keeps_default_pool(self):
+        self.assertEqual(engine_options('sqlite://', {}),
+                         {'pool_pre_ping': True})
+
+    def test_pool_gauges(self):
+        engine = create_engine('sqlite://', poolclass=GaugedQueuePool,
+                               pool_size=2, max_overflow=1,
+                               connect_args={'check_same_thread': False})
+        self.addCleanup(engine.dispose)
+
+        connections = [engine.connect() for _ in range(3)]
+        stats = pool_stats(engine)
+        self.assertEqual(stats['in_use'], 3)
+        self.assertEqual(stats['overflow'], 1)
+        self.assertEqual(stats['checkouts'], 3)
+        self.assertGreaterEqual(stats['checkout_wait_ms_max'],
+                                stats['checkout_wait_ms_avg'])
+
+        for connection in connections:
+            connection.close()
+        stats = pool_stats(engine)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 2)
+
+    def test_metrics(self):
+        res = app.test_client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('pool', res.get_json()['db_pool'])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""
+Benchmarks for trivia API hot paths on a synthetic question bank.
+
+The benchmarks run against a throwaway SQLite database unless DATABASE_URL
+is set. Run all of them with `python benchmarks.py`, or a single one by
+name, e.g. `python benchmarks.py quiz`.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+DATABASE_FILE = os.path.join(tempfile.mkdtemp(), 'trivia_bench.db')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + DATABASE_FILE)
+
+from flaskr import create_app
+from models import db, Question, Category
+from question_search import FullTextSearch, SubstringSearch
+from question_import import QuestionImport
+
+NUM_CATEGORIES = 6
+VOCABULARY = ['w{:04d}'.format(i) for i in range(5000)]
+BATCH_SIZE = 50000
+
+
+def seed_questions(num_questions):
+    # bulk insert a synthetic bank, skipping rows that already exist
+    missing = num_questions - Question.query.count()
+    if Category.query.count() == 0:
+        db.session.add_all(
+            Category('Category {}'.format(i + 1))
+            for i in range(NUM_CATEGORIES)
+        )
+        db.session.commit()
+    rng = random.Random(missing)
+    for start in range(0, max(missing, 0), BATCH_SIZE):
+        db.session.execute(Question.__table__.insert(), [{
+            'question': 'Which {} {} {} {}?'.format(*rng.sample(VOCABULARY, 4)),
+            'answer': 'Answer {}'.format(i),
+            'category': str(i % NUM_CATEGORIES + 1),
+            'difficulty': i % 5 + 1,
+        } for i in range(start, min(start + BATCH_SIZE, missing))])
+        db.session.commit()
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def legacy_quiz_question(category_id, previous_questions):
+    # show_next_quiz_question() before the selection moved into SQL
+    if category_id != 0:
+        questions = Question.query.filter(
+            Question.category == category_id
+        ).all()
+    else:
+        questions = Question.query.all()
+    random.shuffle(questions)
+    for question in questions:
+        if question.id not in previous_questions:
+            return question
+
+
+def bench_quiz(app, num_questions=100000, steps=20):
+    seed_questions(num_questions)
+    client = app.test_client()
+
+    for category_id in (0, 1):
+        previous_questions = []
+
+        def legacy_step():
+            question = legacy_quiz_question(category_id, previous_questions)
+            previous_questions.append(question.id)
+            db.session.remove()
+
+        legacy = timed(legacy_step, steps)
+
+        previous_questions = []
+
+        def step():
+            res = client.post('/quizzes', json={
+                'quiz_category': {'id': category_id},
+                'previous_questions': previous_questions,
+            })
+            previous_questions.append(res.get_json()['question']['id'])
+
+        current = timed(step, steps)
+
+        token = client.post('/quizzes/sessions', json={
+            'quiz_category': {'id': category_id},
+        }).get_json()['session']
+
+        def session_step():
+            res = client.post('/quizzes', json={'session': token})
+            assert res.status_code == 200, res.get_json()
+
+        session = timed(session_step, steps)
+
+        print('quiz step, {} questions, category {}'.format(
+            num_questions, category_id or 'all'))
+        print('  legacy:  {:8.2f} ms/step'.format(legacy * 1000))
+        print('  sql:     {:8.2f} ms/step ({:.0f}x)'.format(
+            current * 1000, legacy / current))
+        print('  session: {:8.2f} ms/step ({:.0f}x)'.format(
+            session * 1000, legacy / session))
+
+
+def bench_search(app, num_questions=1000000, searches=20):
+    seed_questions(num_questions)
+    full_text = FullTextSearch()
+    full_text.setup()
+    terms = random.Random(0).sample(VOCABULARY, searches)
+
+    def search(backend):
+        # what the search branch of POST /questions does for page 1
+        for term in terms:
+            questions = backend.matching(term)
+            questions.count()
+            questions.order_by(Question.id).limit(10).all()
+            db.session.remove()
+
+    substring = timed(lambda: search(SubstringSearch()), 1) / searches
+    ranked = timed(lambda: search(full_text), 1) / searches
+
+    print('question search, {} questions'.format(num_questions))
+    print('  ilike:     {:8.2f} ms/search'.format(substring * 1000))
+    print('  full text: {:8.2f} ms/search ({:.0f}x)'.format(
+        ranked * 1000, substring / ranked))
+
+
+def bench_import(app, num_questions=100000, single_posts=1000):
+    seed_questions(0)
+    client = app.test_client()
+    rows = [{
+        'question': 'Imported question {}?'.format(i),
+        'answer': 'Answer {}'.format(i),
+        'category': i % NUM_CATEGORIES + 1,
+        'difficulty': i % 5 + 1,
+    } for i in range(num_questions)]
+
+    start = time.perf_counter()
+    for row in rows[:single_posts]:
+        client.post('/questions', json=row)
+    single = single_posts / (time.perf_counter() - start)
+
+    lines = [json.dumps(row) + '\n' for row in rows]
+    report = QuestionImport().run(lines, 'jsonl')
+    db.session.remove()
+
+    print('question import, {} questions'.format(num_questions))
+    print('  POST /questions:   {:8.0f} rows/s'.format(single))
+    print('  bulk import:       {:8.0f} rows/s ({:.0f}x), {} failed'.format(
+        report['rows_per_second'], report['rows_per_second'] / single,
+        report['failed']))
+
+
+BENCHMARKS = {
+    'quiz': bench_quiz,
+    'search': bench_search,
+    'import': bench_import,
+}
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        for name in sys.argv[1:] or BENCHMARKS:
+            BENCHMARKS[name](app)
@@ -0,0 +1,91 @@
+"""
+Connection pool settings read from the environment, and pool gauges.
+
+    DB_POOL_PRE_PING   test connections before handing them out (default 1)
+    DB_POOL_SIZE       connections kept open (default 5)
+    DB_MAX_OVERFLOW    extra connections opened under load (default 10)
+    DB_POOL_TIMEOUT    seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE    seconds before a connection is replaced (default 1800)
+
+Pass engine_options(url) as SQLALCHEMY_ENGINE_OPTIONS and read the gauges
+of a running app with pool_stats(db.engine).
+"""
+import os
+import threading
+import time
+
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def _env_flag(environ, name, default):
+    return environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+def engine_options(database_url, environ=os.environ):
+    options = {
+        'pool_pre_ping': _env_flag(environ, 'DB_POOL_PRE_PING', '1'),
+    }
+    # SQLite keeps the pools Flask-SQLAlchemy picks for it
+    if make_url(database_url).get_backend_name() == 'sqlite':
+        return options
+    options.update({
+        'poolclass': GaugedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+    })
+    return options
+
+
+class GaugedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._gauge_lock = threading.Lock()
+
+    def recreate(self):
+        # a new pool is built after a disconnect or dispose(); keep counting
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.wait_total = self.wait_total
+        pool.wait_max = self.wait_max
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._gauge_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'in_use': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+    if isinstance(pool, GaugedQueuePool):
+        with pool._gauge_lock:
+            stats.update({
+                'checkouts': pool.checkouts,
+                'checkout_wait_ms_avg': (
+                    pool.wait_total / pool.checkouts * 1000
+                    if pool.checkouts else 0.0),
+                'checkout_wait_ms_max': pool.wait_max * 1000,
+            })
+    return stats
@@ -1,20 +1,43 @@
+import io
 import os
+import click
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
-from models import setup_db, Question, Category
+from models import db, setup_db, Question, Category, category_cache
+from db_pool import pool_stats
+from quiz_sessions import QuizSession, MemoryQuizSessionStore
+from question_search import SEARCH_BACKENDS, QUESTION_SEARCH_BACKEND
+from question_import import IMPORT_BATCH_SIZE, IMPORT_FORMATS, QuestionImport
 
 QUESTIONS_PER_PAGE = 10
+# question ids looked up per query when picking a quiz session question
+QUIZ_SESSION_BATCH = 32
+IMPORT_CONTENT_TYPES = {
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'text/csv': 'csv',
+}
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.config.from_mapping(test_config or {})
     setup_db(app)
     CORS(app)
 
+    quiz_session_store = app.config.get(
+        'QUIZ_SESSION_STORE',
+        MemoryQuizSessionStore()
+    )
+    question_search = SEARCH_BACKENDS[
+        app.config.get('QUESTION_SEARCH_BACKEND', QUESTION_SEARCH_BACKEND)
+    ]()
+    question_search.setup()
+
     '''
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample
     route after completing the TODOs
@@ -42,8 +65,7 @@ def create_app(test_config=None):
     '''
     @app.route('/categories', methods=['GET'])
     def get_categories():
-        categories = Category.query.all()
-        formatted_categories = {cat.id: cat.type for cat in categories}
+        formatted_categories = get_formatted_categories()
 
         if len(formatted_categories) == 0:
             abort(404)
@@ -70,10 +92,9 @@ def create_app(test_config=None):
     @app.route('/questions', methods=['GET'])
     def get_questions():
 
-        questions = Question.query.all()
         page = request.args.get('page', 1, type=int)
-        formatted_questions = [question.format() for question in questions]
-        paginated_qustions = paginate_questions(page, formatted_questions)
+        after = request.args.get('after', type=int)
+        paginated_qustions = paginate_questions(Question.query, page, after)
 
         if len(paginated_qustions) == 0:
             abort(404)
@@ -81,18 +102,30 @@ def create_app(test_config=None):
         return jsonify({
             'success': True,
             'questions': paginated_qustions,
-            'total_questions': len(formatted_questions),
+            'total_questions': Question.query.count(),
             'categories': get_formatted_categories(),
             'current_category': None,
             'current_page': page,
+            'next_after': get_next_after(paginated_qustions),
         })
 
-    def paginate_questions(page, questions):
-        start = (page-1) * QUESTIONS_PER_PAGE
-        end = start + QUESTIONS_PER_PAGE
+    def paginate_questions(query, page, after=None):
+        # fetch only the requested page from the database: by offset, or
+        # when after is given by keyset, i.e. the questions following that id
+        query = query.order_by(Question.id)
+        if after is not None:
+            query = query.filter(Question.id > after)
+        else:
+            query = query.offset((max(page, 1) - 1) * QUESTIONS_PER_PAGE)
+
+        questions = query.limit(QUESTIONS_PER_PAGE).all()
+        return [question.format() for question in questions]
 
-        current_questions = questions[start:end]
-        return current_questions
+    def get_next_after(questions):
+        # cursor for the next keyset page, None on the last page
+        if len(questions) < QUESTIONS_PER_PAGE:
+            return None
+        return questions[-1]['id']
 
     '''
     @TODO:
@@ -144,32 +177,35 @@ def create_app(test_config=None):
         searchTerm = body.get('searchTerm')
         if searchTerm:
             page = body.get('page')
+            after = body.get('after')
 
             if not isinstance(page, int):
                 page = 1
 
+            if not isinstance(after, int):
+                after = None
+
             try:
-                questions = Question.query.filter(
-                    Question.question.ilike('%{}%'.format(searchTerm))
-                ).all()
-                formatted_questions = [
-                    question.format() for question in questions
-                ]
-                paginated_qustions = paginate_questions(
-                    page,
-                    formatted_questions
-                )
+                questions = question_search.matching(searchTerm)
+                total_questions = questions.count()
 
-                if len(formatted_questions) == 0:
+                if total_questions == 0:
                     abort(404)
 
+                # ranked results are paged by offset only
+                if question_search.ranked:
+                    after = None
+
+                paginated_qustions = paginate_questions(questions, page, after)
+
                 return jsonify({
                     'success': True,
                     'questions': paginated_qustions,
-                    'total_questions': len(formatted_questions),
+                    'total_questions': total_questions,
                     'categories': get_formatted_categories(),
                     'current_category': None,
-                    'current_page': page
+                    'current_page': page,
+                    'next_after': get_next_after(paginated_qustions),
                 })
             except Exception as e:
                 print(e)
@@ -201,6 +237,42 @@ def create_app(test_config=None):
                 print(e)
                 abort(400)
 
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions():
+        import_format = request.args.get(
+            'format',
+            IMPORT_CONTENT_TYPES.get(request.mimetype)
+        )
+        if import_format not in IMPORT_FORMATS:
+            abort(400)
+
+        # read the upload line by line instead of loading it at once
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8',
+                                 newline='')
+        report = QuestionImport().run(lines, import_format)
+
+        return jsonify(dict(report, success=True))
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS),
+                  help='Defaults to csv for .csv files, jsonl otherwise.')
+    @click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+    def import_questions_command(path, import_format, batch_size):
+        '''Import questions from a JSON lines or CSV file.'''
+        if import_format is None:
+            import_format = 'csv' if path.endswith('.csv') else 'jsonl'
+
+        with open(path, encoding='utf-8', newline='') as lines:
+            report = QuestionImport(batch_size).run(lines, import_format)
+
+        for error in report['errors']:
+            click.echo('row {row}: {error}'.format(**error))
+        click.echo(
+            '{imported} imported, {failed} failed in {seconds}s '
+            '({rows_per_second} rows/s)'.format(**report)
+        )
+
     '''
     @TODO:
     Create a GET endpoint to get questions based on category.
@@ -219,17 +291,18 @@ def create_app(test_config=None):
             # query and paginate questions
             questions = Question.query.filter(
                 Question.category == category_id
-            ).all()
+            )
             page = request.args.get('page', 1, type=int)
-            formatted_questions = [question.format() for question in questions]
-            paginated_qustions = paginate_questions(page, formatted_questions)
+            after = request.args.get('after', type=int)
+            paginated_qustions = paginate_questions(questions, page, after)
 
             return jsonify({
                 'success': True,
                 'questions': paginated_qustions,
-                'total_questions': len(formatted_questions),
+                'total_questions': questions.count(),
                 'categories': get_formatted_categories(),
                 'current_category': category_id,
+                'next_after': get_next_after(paginated_qustions),
             })
         except Exception as e:
             print(e)
@@ -249,52 +322,141 @@ def create_app(test_config=None):
     def show_next_quiz_question():
 
         body = request.get_json()
+
+        if body.get('session'):
+            return show_next_session_quiz_question(body['session'])
+
         previous_questions = body.get('previous_questions')
         quiz_category = body.get('quiz_category')
 
-        if quiz_category['id'] != 0:
-            # check if categegory exists first if not return 422
-            category = Category.query.get(quiz_category['id'])
-            if not category:
-                abort(422)
+        check_quiz_category(quiz_category)
 
-            # then get questions
-            questions = Question.query.filter(
-                Question.category == quiz_category['id']
-            ).all()
-        else:
-            questions = Question.query.all()
+        if not previous_questions:
+            previous_questions = []
+
+        question = select_quiz_question(
+            quiz_category['id'],
+            previous_questions
+        )
 
-        if not questions:
+        if not question:
             abort(422)
 
-        random.shuffle(questions)
+        return jsonify({
+            'success': True,
+            'question': question.format(),
+        })
 
-        if not previous_questions:
-            previous_questions = []
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
 
-        question = None
-        index = 0
+        body = request.get_json()
+        quiz_category = body.get('quiz_category')
 
-        while not question:
-            try:
-                if questions[index].id in previous_questions:
-                    index += 1
-                else:
-                    question = questions[index]
-            except Exception as e:
-                print(e)
-                abort(422)
+        if not isinstance(quiz_category, dict) or 'id' not in quiz_category:
+            abort(400)
+
+        check_quiz_category(quiz_category)
+        first_id, last_id = db.session.query(
+            db.func.min(Question.id), db.func.max(Question.id)
+        ).one()
+        num_ids = last_id - first_id + 1 if first_id is not None else 0
+        num_questions = Question.query
+        if quiz_category['id'] != 0:
+            num_questions = num_questions.filter(
+                Question.category == quiz_category['id']
+            )
+        token = quiz_session_store.create(QuizSession(
+            quiz_category['id'], first_id or 0, num_ids,
+            num_questions.count()
+        ))
+
+        return jsonify({
+            'success': True,
+            'session': token,
+        })
+
+    def show_next_session_quiz_question(token):
+        session = quiz_session_store.get(token)
+        if session is None:
+            abort(404)
+
+        question = select_session_quiz_question(session)
+        quiz_session_store.save(token, session)
+        if not question:
+            abort(422)
 
         return jsonify({
             'success': True,
             'question': question.format(),
+            'session': token,
         })
 
+    def check_quiz_category(quiz_category):
+        if quiz_category['id'] != 0:
+            # check if categegory exists first if not return 422
+            category = Category.query.get(quiz_category['id'])
+            if not category:
+                abort(422)
+
+    def select_session_quiz_question(session):
+        # walks the session's random order of the id range, fetching the
+        # next QUIZ_SESSION_BATCH ids at once by primary key and asking
+        # the first one that is a question of the category
+        while True:
+            candidates = session.candidate_ids(QUIZ_SESSION_BATCH)
+            if not candidates:
+                return None
+
+            questions = Question.query.filter(
+                Question.id.in_([id for _, id in candidates])
+            )
+            if session.category_id != 0:
+                questions = questions.filter(
+                    Question.category == session.category_id
+                )
+            found = {question.id: question for question in questions}
+
+            for position, question_id in candidates:
+                if question_id in found:
+                    session.position = position + 1
+                    session.asked += 1
+                    return found[question_id]
+            session.position = candidates[-1][0] + 1
+
+    def select_quiz_question(category_id, previous_questions):
+        # picks a random unseen question in the database: count the
+        # candidates, then fetch the one at a random offset, so no more
+        # than a single question is ever loaded
+        questions = Question.query
+        if category_id != 0:
+            questions = questions.filter(Question.category == category_id)
+        if previous_questions:
+            questions = questions.filter(
+                ~Question.id.in_(previous_questions)
+            )
+
+        total_questions = questions.count()
+        if total_questions == 0:
+            return None
+
+        return (
+            questions
+            .order_by(Question.id)
+            .offset(random.randrange(total_questions))
+            .first()
+        )
+
     def get_formatted_categories():
-        categories = Category.query.all()
-        formatted_categories = {cat.id: cat.type for cat in categories}
-        return formatted_categories
+        return category_cache.get()
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return jsonify({
+            'success': True,
+            'category_cache': category_cache.stats(),
+            'db_pool': pool_stats(db.engine),
+        })
 
     '''
     @TODO:
@@ -0,0 +1,12 @@
+-- Full-text search over questions for QUESTION_SEARCH_BACKEND=fulltext.
+-- Requires PostgreSQL 12 or newer for the generated column. Apply with
+--   psql trivia < migrations/001_question_search_vector.sql
+-- and revert with
+--   DROP INDEX ix_questions_search_vector;
+--   ALTER TABLE questions DROP COLUMN search_vector;
+
+ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(question, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_questions_search_vector
+    ON questions USING gin (search_vector);
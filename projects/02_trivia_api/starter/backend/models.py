@@ -1,14 +1,23 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import threading
+import time
+from sqlalchemy import Column, String, Integer, create_engine, event
+from sqlalchemy.orm import Session, object_session
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from db_pool import engine_options
+
 DB_HOST = os.getenv('DB_HOST', '127.0.0.1:5432')  
 DB_USER = os.getenv('DB_USER', 'postgres')  
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')  
 DB_NAME = os.getenv('DB_NAME', 'trivia')  
+CATEGORY_CACHE_TTL = float(os.getenv('CATEGORY_CACHE_TTL', 300))
 
-database_path = 'postgresql+psycopg2://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
+database_path = os.getenv(
+    'DATABASE_URL',
+    'postgresql+psycopg2://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
+)
 
 db = SQLAlchemy()
 
@@ -16,6 +25,7 @@ db = SQLAlchemy()
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
     db.create_all()
@@ -71,3 +81,82 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+class CategoryCache:
+    '''
+    Process-wide cache of the {id: type} category map.
+
+    Entries expire after ttl seconds and every committed write to Category
+    bumps the version, which invalidates the cached map. The version moves
+    on commit, not flush, so a map loaded before a write is visible is
+    stored under the old version and therefore never served.
+    The returned dict is shared between callers and must not be modified.
+    '''
+
+    def __init__(self, ttl=CATEGORY_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entry = None
+
+    def get(self):
+        with self._lock:
+            entry = self._entry
+            if entry and entry[0] == self.version and \
+                    entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            version = self.version
+
+        categories = Category.query.order_by(Category.id).all()
+        formatted_categories = {cat.id: cat.type for cat in categories}
+
+        with self._lock:
+            self._entry = (
+                version,
+                time.monotonic() + self.ttl,
+                formatted_categories
+            )
+        return formatted_categories
+
+    def invalidate(self, *args):
+        with self._lock:
+            self.version += 1
+            self._entry = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version,
+            'ttl': self.ttl
+        }
+
+
+category_cache = CategoryCache()
+
+CATEGORIES_CHANGED = 'categories_changed'
+
+
+def mark_categories_changed(mapper, connection, target):
+    # flushed writes are not visible to other sessions until the commit
+    object_session(target).info[CATEGORIES_CHANGED] = True
+
+
+def invalidate_after_commit(session):
+    if session.info.pop(CATEGORIES_CHANGED, False):
+        category_cache.invalidate()
+
+
+def forget_categories_changed(session):
+    session.info.pop(CATEGORIES_CHANGED, None)
+
+
+for event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, event_name, mark_categories_changed)
+event.listen(Session, 'after_commit', invalidate_after_commit)
+event.listen(Session, 'after_rollback', forget_categories_changed)
@@ -0,0 +1,142 @@
+import csv
+import json
+import os
+import time
+
+from models import db, Question, Category
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# at most this many row errors are listed in an import report
+MAX_IMPORT_ERRORS = 100
+IMPORT_FORMATS = ('jsonl', 'csv')
+IMPORT_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def read_rows(lines, format):
+    '''
+    Yields (row number, row) for every row of a JSON lines or CSV source,
+    where row is a dict, or the reason the row could not be read. CSV
+    sources start with a header row naming the columns.
+    '''
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, 'too many columns'
+            else:
+                yield reader.line_num, row
+        return
+
+    for row_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield row_number, 'invalid JSON'
+            continue
+        yield row_number, row if isinstance(row, dict) else 'not an object'
+
+
+def validate_row(row, category_ids):
+    '''
+    Returns the questions table values of a row, or raises ValueError
+    explaining why the row is invalid.
+    '''
+    missing = [field for field in IMPORT_FIELDS if row.get(field) in (None, '')]
+    if missing:
+        raise ValueError('missing ' + ', '.join(missing))
+
+    question = row['question']
+    answer = row['answer']
+    if not isinstance(question, str) or not isinstance(answer, str):
+        raise ValueError('question and answer must be text')
+
+    category = str(row['category']).strip()
+    if category not in category_ids:
+        raise ValueError('unknown category {}'.format(category))
+
+    try:
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError):
+        raise ValueError('difficulty must be a number')
+    if not 1 <= difficulty <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+
+    return {
+        'question': question.strip(),
+        'answer': answer.strip(),
+        'category': category,
+        'difficulty': difficulty,
+    }
+
+
+class QuestionImport:
+    '''
+    Validates question rows and inserts the valid ones in batches of
+    batch_size, each with a single executemany INSERT and commit. Invalid
+    rows are skipped and reported with their row number.
+    '''
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.category_ids = {
+            str(category_id)
+            for category_id, in db.session.query(Category.id)
+        }
+        self._batch = []
+        self._batch_rows = []
+        self._start = time.perf_counter()
+
+    def run(self, lines, format):
+        for row_number, row in read_rows(lines, format):
+            self.add(row_number, row)
+        self.flush()
+        return self.report()
+
+    def add(self, row_number, row):
+        try:
+            if isinstance(row, str):
+                raise ValueError(row)
+            values = validate_row(row, self.category_ids)
+        except ValueError as error:
+            self.fail(row_number, str(error))
+            return
+
+        self._batch.append(values)
+        self._batch_rows.append(row_number)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        try:
+            db.session.execute(Question.__table__.insert(), self._batch)
+            db.session.commit()
+            self.imported += len(self._batch)
+        except Exception as error:
+            db.session.rollback()
+            for row_number in self._batch_rows:
+                self.fail(row_number, 'not inserted: {}'.format(
+                    str(error).splitlines()[0]))
+        self._batch = []
+        self._batch_rows = []
+
+    def fail(self, row_number, error):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'row': row_number, 'error': error})
+
+    def report(self):
+        seconds = time.perf_counter() - self._start
+        return {
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.imported / seconds) if seconds else 0,
+        }
@@ -0,0 +1,119 @@
+import os
+from sqlalchemy import Float, Integer, false, text
+
+from models import db, Question
+
+QUESTION_SEARCH_BACKEND = os.getenv('QUESTION_SEARCH_BACKEND', 'substring')
+
+SQLITE_FTS_SETUP = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts
+    USING fts5(question, content='questions', content_rowid='id')
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS questions_fts_insert
+    AFTER INSERT ON questions BEGIN
+        INSERT INTO questions_fts(rowid, question)
+        VALUES (new.id, new.question);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS questions_fts_delete
+    AFTER DELETE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question)
+        VALUES ('delete', old.id, old.question);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS questions_fts_update
+    AFTER UPDATE ON questions BEGIN
+        INSERT INTO questions_fts(questions_fts, rowid, question)
+        VALUES ('delete', old.id, old.question);
+        INSERT INTO questions_fts(rowid, question)
+        VALUES (new.id, new.question);
+    END
+    ''',
+    "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+]
+
+
+class SubstringSearch:
+    '''
+    Matches questions containing the search term anywhere, ordered by id.
+    Supports keyset pagination.
+    '''
+    ranked = False
+
+    def setup(self):
+        pass
+
+    def matching(self, search_term):
+        return Question.query.filter(
+            Question.question.ilike('%{}%'.format(search_term))
+        )
+
+
+class FullTextSearch:
+    '''
+    Matches questions containing the words of the search term, best match
+    first.
+
+    On Postgres this uses the search_vector tsvector column and its GIN
+    index added by migrations/001_question_search_vector.sql. Other
+    backends (SQLite) use an FTS5 index created by setup() and kept in sync
+    with triggers.
+    '''
+    ranked = True
+
+    def setup(self):
+        if db.engine.dialect.name == 'postgresql':
+            return
+        with db.engine.begin() as connection:
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'questions_fts'"
+            )).first()
+            if exists:
+                return
+            for statement in SQLITE_FTS_SETUP:
+                connection.execute(text(statement))
+
+    def matching(self, search_term):
+        if db.engine.dialect.name == 'postgresql':
+            tsquery = "plainto_tsquery('english', :search_term)"
+            return (
+                Question.query
+                .filter(text('search_vector @@ ' + tsquery))
+                .order_by(text(
+                    'ts_rank(search_vector, {}) DESC'.format(tsquery)
+                ))
+                .params(search_term=search_term)
+            )
+
+        # quote every word so FTS5 query syntax in user input is ignored
+        fts_query = ' '.join(
+            '"{}"'.format(word.replace('"', '""'))
+            for word in search_term.split()
+        )
+        if not fts_query:
+            return Question.query.filter(false())
+
+        matches = (
+            text(
+                'SELECT rowid AS id, rank FROM questions_fts '
+                'WHERE questions_fts MATCH :fts_query'
+            )
+            .bindparams(fts_query=fts_query)
+            .columns(id=Integer, rank=Float)
+            .alias('matches')
+        )
+        return (
+            Question.query
+            .join(matches, matches.c.id == Question.id)
+            .order_by(matches.c.rank)
+        )
+
+
+SEARCH_BACKENDS = {
+    'substring': SubstringSearch,
+    'fulltext': FullTextSearch,
+}
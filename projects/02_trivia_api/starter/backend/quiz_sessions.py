@@ -0,0 +1,139 @@
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+
+QUIZ_SESSION_LIMIT = 10000
+
+
+class KeyedPermutation:
+    '''
+    A pseudo-random permutation of range(size) drawn from key, computed one
+    position at a time in constant memory: a Feistel network over the
+    smallest even number of bits covering size, cycle-walking past values
+    that fall outside the range.
+    '''
+    ROUNDS = 4
+
+    def __init__(self, size, key):
+        self.size = size
+        self.key = key
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+
+    def _round(self, value, round):
+        digest = hashlib.blake2b(
+            b'%d:%d:%d' % (self.key, round, value), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, 'big') & self.mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.mask
+        for round in range(self.ROUNDS):
+            left, right = right, left ^ self._round(right, round)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, position):
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __len__(self):
+        return self.size
+
+
+class QuizSession:
+    '''
+    State of one quiz: the category played (0 for all categories), the
+    question id range when the quiz started, and how far along a keyed
+    random order of that range it is.
+
+    The order never repeats an id, so no seen-set is needed and a session
+    takes the same few bytes however many questions there are. Ids that
+    are missing or belong to another category are skipped when picking the
+    next question; questions added after the quiz started are not part of
+    it.
+    '''
+
+    def __init__(self, category_id, first_id=0, num_ids=0, num_questions=None,
+                 key=None):
+        self.category_id = category_id
+        self.first_id = first_id
+        self.num_ids = num_ids
+        # questions of the category, so the last step need not walk the
+        # rest of the range to find there is nothing left
+        self.num_questions = num_ids if num_questions is None else num_questions
+        self.key = secrets.randbits(63) if key is None else key
+        self.position = 0
+        self.asked = 0
+
+    def candidate_ids(self, count):
+        '''
+        The (position, question id) of the next count ids in the quiz
+        order; empty once the whole range has been gone through.
+        '''
+        if self.asked >= self.num_questions:
+            return []
+        order = KeyedPermutation(self.num_ids, self.key)
+        end = min(self.position + count, self.num_ids)
+        return [(position, self.first_id + order[position])
+                for position in range(self.position, end)]
+
+
+class QuizSessionStore:
+    '''
+    Interface for quiz session storage backends.
+
+    create() stores a new session and returns its token, get() returns the
+    session for a token or None if it is unknown or expired, and save()
+    writes a modified session back.
+    '''
+
+    def create(self, session):
+        raise NotImplementedError
+
+    def get(self, token):
+        raise NotImplementedError
+
+    def save(self, token, session):
+        raise NotImplementedError
+
+    @staticmethod
+    def new_token():
+        return secrets.token_urlsafe(16)
+
+
+class MemoryQuizSessionStore(QuizSessionStore):
+    '''
+    In-process store keeping the most recently used max_sessions sessions,
+    evicting the least recently used one when full.
+    '''
+
+    def __init__(self, max_sessions=QUIZ_SESSION_LIMIT):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session):
+        token = self.new_token()
+        self.save(token, session)
+        return token
+
+    def get(self, token):
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is not None:
+                self._sessions.move_to_end(token)
+            return session
+
+    def save(self, token, session):
+        with self._lock:
+            self._sessions[token] = session
+            self._sessions.move_to_end(token)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
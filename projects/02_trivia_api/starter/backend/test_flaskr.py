@@ -1,10 +1,12 @@
 import os
+import threading
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from models import setup_db, Question, Category, category_cache
+from quiz_sessions import QuizSession, MemoryQuizSessionStore
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -53,6 +55,63 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'method not allowed')
 
+    def test_categories_served_from_cache(self):
+        self.client().get('/categories')
+        hits = category_cache.hits
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(category_cache.hits, hits + 1)
+        self.assertEqual(len(data['categories']), Category.query.count())
+
+    def test_category_write_invalidates_cache(self):
+        self.client().get('/categories')
+        misses = category_cache.misses
+        category = Category('Music')
+        self.db.session.add(category)
+        self.db.session.commit()
+
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+        self.db.session.delete(category)
+        self.db.session.commit()
+
+        self.assertEqual(category_cache.misses, misses + 1)
+        self.assertIn('Music', data['categories'].values())
+
+    def test_map_loaded_before_commit_not_served(self):
+        category = Category('Music')
+        self.db.session.add(category)
+        self.db.session.flush()
+
+        def load_categories():
+            with self.app.app_context():
+                category_cache.get()
+        # another request loads the map between the flush and the commit
+        loader = threading.Thread(target=load_categories)
+        loader.start()
+        loader.join()
+        self.db.session.commit()
+
+        with self.app.app_context():
+            categories = category_cache.get()
+        self.db.session.delete(category)
+        self.db.session.commit()
+
+        self.assertIn('Music', categories.values())
+
+    def test_get_metrics(self):
+        res = self.client().get('/metrics')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIn('hits', data['category_cache'])
+        self.assertIn('misses', data['category_cache'])
+        self.assertIn('pool', data['db_pool'])
+
     def test_get_paginated_questions(self):
         res = self.client().get('/questions')
         data = json.loads(res.data)
@@ -65,6 +124,21 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsNone(data['current_category'])
         self.assertEqual(data['current_page'], 1)
 
+    def test_get_questions_after_cursor(self):
+        res = self.client().get('/questions')
+        first_page = json.loads(res.data)
+        after = first_page['next_after']
+
+        res = self.client().get('/questions?after={}'.format(after))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(after, first_page['questions'][-1]['id'])
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(q['id'] > after for q in data['questions']))
+        self.assertEqual(data['total_questions'], Question.query.count())
+
     def test_404_sent_requesting_beyond_valid_page(self):
         res = self.client().get('/questions?page=1000', json={'rating': 1})
         self.do_tests_for_404(res)
@@ -116,6 +190,52 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/questions', json=newQuestion)
         self.do_tests_for_400(res)
 
+    def test_import_questions_jsonl(self):
+        total_questions = Question.query.count()
+        rows = [
+            {'question': 'Bulk {}?'.format(i), 'answer': 'yes',
+             'category': 5, 'difficulty': 2}
+            for i in range(3)
+        ] + [
+            {'question': 'No answer?', 'category': 5, 'difficulty': 2},
+            {'question': 'Bad?', 'answer': 'no', 'category': 100,
+             'difficulty': 2},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\n{oops\n'
+
+        res = self.client().post('/questions/import?format=jsonl', data=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['imported'], 3)
+        self.assertEqual(data['failed'], 3)
+        self.assertEqual(data['errors'], [
+            {'row': 4, 'error': 'missing answer'},
+            {'row': 5, 'error': 'unknown category 100'},
+            {'row': 6, 'error': 'invalid JSON'},
+        ])
+        self.assertIn('rows_per_second', data)
+        self.assertEqual(Question.query.count(), total_questions + 3)
+
+    def test_import_questions_csv(self):
+        body = ('question,answer,category,difficulty\n'
+                'Bulk CSV?,yes,5,3\n'
+                'Too hard?,yes,5,9\n')
+
+        res = self.client().post('/questions/import', data=body,
+                                 content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['imported'], 1)
+        self.assertEqual(data['errors'], [
+            {'row': 3, 'error': 'difficulty must be between 1 and 5'}])
+
+    def test_import_questions_unknown_format(self):
+        res = self.client().post('/questions/import', data='question\n')
+        self.do_tests_for_400(res)
+
     def test_search_question(self):
         data = {
             'searchTerm': 'did',
@@ -148,6 +268,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['categories']))
         self.assertEqual(data['current_page'], 2)
 
+    def test_search_question_after_cursor(self):
+        data = {
+            'searchTerm': 'a',
+            'after': 20,
+        }
+
+        res = self.client().post('/questions', json=data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['questions']))
+        self.assertTrue(all(q['id'] > 20 for q in data['questions']))
+        self.assertEqual(data['total_questions'], 16)
+        self.assertIsNone(data['next_after'])
+
+    def test_full_text_search_question(self):
+        app = create_app({'QUESTION_SEARCH_BACKEND': 'fulltext'})
+        setup_db(app, self.database_path)
+
+        res = app.test_client().post('/questions', json={
+            'searchTerm': 'palace mirrors',
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['id'], 14)
+
     def test_search_with_no_results(self):
         data = {
             'searchTerm': 'xyz',
@@ -191,6 +341,26 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['question']))
 
+    def test_next_quiz_question_skips_previous_questions(self):
+        data = {
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'previous_questions': [20, 21],
+        }
+        res = self.client().post('/quizzes', json=data)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], 22)
+
+    def test_422_when_all_quiz_questions_asked(self):
+        data = {
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'previous_questions': [20, 21, 22],
+        }
+        res = self.client().post('/quizzes', json=data)
+        self.do_tests_for_422(res)
+
     def test_get_next_quiz_question_for_invalid_category(self):
         data = {
             'quiz_category': {'type': 'Random Stuff', 'id': 100},
@@ -200,6 +370,39 @@ class TriviaTestCase(unittest.TestCase):
         data = json.loads(res.data)
         self.do_tests_for_422(res)
 
+    def test_quiz_session(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Science', 'id': 1},
+        })
+        data = json.loads(res.data)
+        token = data['session']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(token)
+
+        asked = set()
+        for _ in range(3):
+            res = self.client().post('/quizzes', json={'session': token})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data['session'], token)
+            asked.add(data['question']['id'])
+
+        self.assertEqual(asked, {20, 21, 22})
+        res = self.client().post('/quizzes', json={'session': token})
+        self.do_tests_for_422(res)
+
+    def test_quiz_session_for_invalid_category(self):
+        res = self.client().post('/quizzes/sessions', json={
+            'quiz_category': {'type': 'Random Stuff', 'id': 100},
+        })
+        self.do_tests_for_422(res)
+
+    def test_unknown_quiz_session(self):
+        res = self.client().post('/quizzes', json={'session': 'unknown'})
+        self.do_tests_for_404(res)
+
     def do_tests_for_400(self, res):
         data = json.loads(res.data)
         self.assertEqual(res.status_code, 400)
@@ -219,6 +422,57 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'unprocessable')
 
 
+class QuizSessionStoreTestCase(unittest.TestCase):
+    """This class represents the quiz session store test case"""
+
+    def test_get_returns_saved_session(self):
+        store = MemoryQuizSessionStore()
+        token = store.create(QuizSession(1))
+        session = store.get(token)
+        session.position = 3
+        store.save(token, session)
+
+        self.assertEqual(store.get(token).category_id, 1)
+        self.assertEqual(store.get(token).position, 3)
+        self.assertIsNone(store.get('unknown'))
+
+    def test_session_order_covers_id_range_once(self):
+        for num_ids in (1, 2, 7, 64, 1000):
+            session = QuizSession(1, first_id=5, num_ids=num_ids)
+
+            ids = [id for _, id in session.candidate_ids(num_ids + 10)]
+
+            self.assertEqual(sorted(ids), list(range(5, 5 + num_ids)))
+        self.assertEqual(QuizSession(1).candidate_ids(10), [])
+
+    def test_session_ends_after_last_question(self):
+        session = QuizSession(1, first_id=1, num_ids=100, num_questions=1)
+        session.asked = 1
+
+        self.assertEqual(session.candidate_ids(10), [])
+
+    def test_session_order_depends_on_key(self):
+        orders = [
+            [id for _, id in
+             QuizSession(1, 0, 100, key=key).candidate_ids(100)]
+            for key in (1, 1, 2)
+        ]
+
+        self.assertEqual(orders[0], orders[1])
+        self.assertNotEqual(orders[0], orders[2])
+
+    def test_evicts_least_recently_used_session(self):
+        store = MemoryQuizSessionStore(max_sessions=2)
+        first = store.create(QuizSession(1))
+        second = store.create(QuizSession(2))
+        store.get(first)
+        store.create(QuizSession(3))
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNotNone(store.get(first))
+        self.assertIsNone(store.get(second))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
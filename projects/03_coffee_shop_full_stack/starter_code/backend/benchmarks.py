@@ -0,0 +1,201 @@
+"""
+Benchmarks for coffee shop API hot paths.
+
+Tokens are signed with the throwaway key from test_auth.py and verified
+against a local stand-in for the Auth0 JWKS endpoint, so no network access
+is needed. Run all of them with `python benchmarks.py`, or a single one by
+name, e.g. `python benchmarks.py auth`.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flask import Flask
+
+from src.auth import auth
+from src.auth.auth import JWKSCache, VerifiedTokenCache
+from src.database.models import db, setup_db, drinks_json, Drink, RecipeType
+from test_auth import StubJWKSServer, create_test_app, make_token
+from test_models import run_writers
+
+
+def requests_per_second(function, duration=2.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def bench_auth(num_tokens=10):
+    server = StubJWKSServer()
+    auth.jwks_cache = JWKSCache(server.url)
+    client = create_test_app().test_client()
+    # a handful of clients, each reusing its bearer token
+    headers = [{'Authorization': 'Bearer ' + make_token(expires_in=3600 + i)}
+               for i in range(num_tokens)]
+    calls = 0
+
+    def request():
+        nonlocal calls
+        res = client.get('/drinks-detail', headers=headers[calls % num_tokens])
+        assert res.status_code == 200, res.get_json()
+        calls += 1
+
+    try:
+        auth.token_cache = VerifiedTokenCache(max_size=0)
+        uncached = requests_per_second(request)
+        auth.token_cache = VerifiedTokenCache()
+        cached = requests_per_second(request)
+    finally:
+        auth.jwks_cache.stop()
+        server.stop()
+
+    print('requires_auth, {} distinct tokens'.format(num_tokens))
+    print('  verify every request: {:8.0f} req/s'.format(uncached))
+    print('  verified-token cache: {:8.0f} req/s ({:.1f}x)'.format(
+        cached, cached / uncached))
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def seed_drinks(num_drinks, native_json):
+    app = Flask(__name__)
+    setup_db(app, 'sqlite://')
+    app.app_context().push()
+    Drink.__table__.c.recipe.type = RecipeType(native_json=native_json)
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Drink.__table__.insert(), [{
+        'title': 'Drink {}'.format(i),
+        'recipe': [{'color': 'c{}'.format(j), 'name': 'n{}'.format(j),
+                    'parts': j} for j in range(1, 4)],
+    } for i in range(num_drinks)])
+    db.session.commit()
+
+
+def legacy_short(drink):
+    # Drink.short() before recipes were parsed once per loaded value
+    short_recipe = [{'color': r['color'], 'parts': r['parts']}
+                    for r in json.loads(drink.recipe)]
+    return {'id': drink.id, 'title': drink.title, 'recipe': short_recipe}
+
+
+def legacy_long(drink):
+    return {'id': drink.id, 'title': drink.title,
+            'recipe': json.loads(drink.recipe)}
+
+
+def bench_recipes(num_drinks=5000, repeat=20):
+    # what get_drinks() and get_drinks_detail() do per request: load the
+    # rows in a fresh session and serialize each of them
+    results = {}
+    for native_json in (False, True):
+        seed_drinks(num_drinks, native_json)
+        for name, legacy, current in (('short', legacy_short, Drink.short),
+                                      ('long', legacy_long, Drink.long)):
+            for label, serialize in (('json.loads per call', legacy),
+                                     ('parsed recipe', current)):
+                if native_json and serialize is legacy:
+                    continue
+
+                def listing():
+                    [serialize(drink) for drink in Drink.query.all()]
+                    db.session.remove()
+
+                def reserialize():
+                    # short(), long() and repr() of rows already loaded
+                    for _ in range(3):
+                        [serialize(drink) for drink in drinks]
+
+                drinks = Drink.query.all()
+                results[name, native_json, label] = (
+                    timed(listing, repeat), timed(reserialize, repeat))
+                db.session.remove()
+
+    print('drink listing serialization, {} drinks'.format(num_drinks))
+    for (name, native_json, label), (listing, again) in results.items():
+        print('  {:5} {:4} column, {:19}: {:8.2f} ms/request, '
+              '{:8.2f} ms for 3 more calls'.format(
+                  name, 'json' if native_json else 'text', label,
+                  listing * 1000, again * 1000))
+
+
+def bench_writers(num_threads=64, writes_per_thread=50):
+    print('concurrent writers, {} threads'.format(num_threads))
+    for tuned in (False, True):
+        app = Flask(__name__)
+        # tune_sqlite=False is setup_db() before WAL, busy_timeout and the
+        # connection pool
+        setup_db(app, 'sqlite:///' + os.path.join(tempfile.mkdtemp(),
+                                                  'writers.db'),
+                 tune_sqlite=tuned)
+        with app.app_context():
+            db.create_all()
+
+        start = time.perf_counter()
+        errors = run_writers(app, num_threads, writes_per_thread)
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            writes = Drink.query.count() + Drink.query.filter(
+                Drink.title.startswith('renamed')).count()
+        print('  {:8}: {:8.0f} writes/s, {} of {} writers failed{}'.format(
+            'tuned' if tuned else 'defaults', writes / elapsed,
+            len(errors), num_threads,
+            ': {}'.format(errors[0]).split('\n')[0] if errors else ''))
+
+
+def measured(function):
+    # time and memory in separate runs, tracing slows allocation down
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    db.session.remove()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+    return elapsed, peak
+
+
+def bench_listing(num_drinks=50000):
+    seed_drinks(num_drinks, native_json=False)
+
+    print('drink listing, {} drinks'.format(num_drinks))
+    for form in ('short', 'long'):
+        def orm():
+            # get_drinks() and get_drinks_detail() before the projected path
+            drinks = [getattr(drink, form)() for drink in Drink.query.all()]
+            json.dumps({'success': True, 'drinks': drinks}).encode()
+
+        def streamed():
+            for chunk in drinks_json(form):
+                chunk.encode()
+
+        for name, function in (('orm', orm), ('projected, streamed', streamed)):
+            elapsed, peak = measured(function)
+            print('  {:5} {:19}: {:8.0f} ms, peak {:6.1f} MiB'.format(
+                form, name, elapsed * 1000, peak / 2 ** 20))
+
+
+BENCHMARKS = {
+    'auth': bench_auth,
+    'recipes': bench_recipes,
+    'writers': bench_writers,
+    'listing': bench_listing,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
@@ -1,11 +1,16 @@
+import io
 import os
-from flask import Flask, request, jsonify, abort
+import click
+from flask import Flask, request, jsonify, abort, stream_with_context
 from sqlalchemy import exc
 import json
 from flask_cors import CORS
 
-from .database.models import db_drop_and_create_all, setup_db, Drink
-from .auth.auth import AuthError, requires_auth
+from .database.models import (
+    db_drop_and_create_all, setup_db, Drink, drink_menu_cache, drinks_json
+)
+from .database.bulk import IMPORT_BATCH_SIZE, DrinkImport, drinks_ndjson
+from .auth.auth import AuthError, requires_auth, all_of
 
 app = Flask(__name__)
 setup_db(app)
@@ -33,14 +38,20 @@ CORS(app)
 @app.route('/drinks', methods=['GET'])
 def get_drinks():
 
-    drinkModels = Drink.query.all()
-    drinks = []
-    for drinkModel in drinkModels:
-        drinks.append(drinkModel.short())
+    body, etag = drink_menu_cache.get()
+    if request.if_none_match.contains(etag):
+        drink_menu_cache.record_not_modified()
 
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
     return jsonify({
                     "success": True,
-                    "drinks": drinks
+                    "drink_menu_cache": drink_menu_cache.stats()
                     })
 
 
@@ -58,15 +69,10 @@ def get_drinks():
 @app.route('/drinks-detail', methods=['GET'])
 @requires_auth('get:drinks-detail')
 def get_drinks_detail(payload):
-    drinkModels = Drink.query.all()
-    drinks = []
-    for drinkModel in drinkModels:
-        drinks.append(drinkModel.long())
-
-    return jsonify({
-                    "success": True,
-                    "drinks": drinks
-                    })
+    # streamed, so large menus are never held in memory at once
+    return app.response_class(
+        stream_with_context(drinks_json('long')),
+        mimetype='application/json')
 
 '''
 @TODO implement endpoint
@@ -113,6 +119,64 @@ def get_recipe_from_body(body):
 
     return recipe
 
+
+'''
+POST /drinks/import
+    creates or updates drinks from an NDJSON upload, one
+    {"title": ..., "recipe": [...]} object per line
+    it requires the 'post:drinks' and 'patch:drinks' permissions
+    returns status code 200 and json {"success": True, "created": ...,
+        "updated": ..., "failed": ..., "errors": [{"row": ..., "error": ...}],
+        "seconds": ..., "rows_per_second": ...}
+'''
+
+
+@app.route('/drinks/import', methods=['POST'])
+@requires_auth(all_of('post:drinks', 'patch:drinks'))
+def import_drinks(payload):
+
+    # read the upload line by line instead of loading it at once
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8')
+    report = DrinkImport().run(lines)
+
+    return jsonify(dict(report, success=True))
+
+
+'''
+GET /drinks/export
+    streams every drink in its long form as NDJSON
+    it requires the 'get:drinks-detail' permission
+'''
+
+
+@app.route('/drinks/export', methods=['GET'])
+@requires_auth('get:drinks-detail')
+def export_drinks(payload):
+    return app.response_class(
+        stream_with_context(drinks_ndjson()),
+        mimetype='application/x-ndjson')
+
+
+@app.cli.command('import-drinks')
+@click.argument('path', type=click.File(encoding='utf-8'))
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True)
+def import_drinks_command(path, batch_size):
+    '''Create or update drinks from an NDJSON file ('-' reads stdin).'''
+    report = DrinkImport(batch_size).run(path)
+    for error in report['errors']:
+        click.echo('row {row}: {error}'.format(**error), err=True)
+    click.echo('{created} created, {updated} updated, {failed} failed in '
+               '{seconds}s ({rows_per_second} rows/s)'.format(**report),
+               err=True)
+
+
+@app.cli.command('export-drinks')
+@click.argument('path', type=click.File('w', encoding='utf-8'), default='-')
+def export_drinks_command(path):
+    '''Write every drink as NDJSON to a file (stdout by default).'''
+    for line in drinks_ndjson():
+        path.write(line)
+
 '''
 @TODO implement endpoint
     PATCH /drinks/<id>
@@ -1,4 +1,9 @@
+import hashlib
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, jsonify
 from functools import wraps
 from jose import jwt
@@ -8,6 +13,16 @@ from urllib.request import urlopen
 AUTH0_DOMAIN = 'fsndcoffeeshop.eu.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'coffeeshop'
+JWKS_URL = f'https://{AUTH0_DOMAIN}/.well-known/jwks.json'
+# seconds until cached keys are refreshed in the background
+JWKS_TTL = 600
+# minimum seconds between refetches triggered by an unknown kid
+JWKS_MIN_REFETCH_INTERVAL = 30
+JWKS_FETCH_TIMEOUT = 5
+# number of verified tokens remembered, 0 disables the cache
+TOKEN_CACHE_SIZE = 1024
+
+logger = logging.getLogger(__name__)
 
 # AuthError Exception
 '''
@@ -65,10 +80,98 @@ def get_token_auth_header():
     token = parts[1]
     return token
 
+
+# Permissions
+'''
+PermissionPolicy
+a permission requirement compiled once, when requires_auth() decorates a
+view. A policy holds a frozenset of permissions and nested policies and
+is satisfied when all of them (all_of) or any of them (any_of) are
+granted, so the cost of a check depends on the size of the policy, not
+on the number of permissions in the token.
+    EXAMPLE
+        @requires_auth(any_of('patch:drinks', all_of('delete:drinks',
+                                                      'post:drinks')))
+'''
+
+
+class PermissionPolicy:
+    def __init__(self, require_all, permissions=(), policies=()):
+        self.require_all = require_all
+        self.permissions = frozenset(permissions)
+        self.policies = tuple(policies)
+
+    def allows(self, granted):
+        if self.require_all:
+            return (self.permissions <= granted and
+                    all(policy.allows(granted) for policy in self.policies))
+        return (not self.permissions.isdisjoint(granted) or
+                any(policy.allows(granted) for policy in self.policies))
+
+    def __repr__(self):
+        return '{}({})'.format(
+            'all_of' if self.require_all else 'any_of',
+            ', '.join([repr(p) for p in sorted(self.permissions)] +
+                      [repr(p) for p in self.policies]))
+
+
+def _policy(require_all, requirements):
+    permissions = []
+    policies = []
+    for requirement in requirements:
+        if isinstance(requirement, PermissionPolicy):
+            policies.append(requirement)
+        elif isinstance(requirement, str):
+            permissions.append(requirement)
+        else:
+            raise TypeError(
+                'permissions must be strings or policies, not {!r}'.format(
+                    requirement))
+    return PermissionPolicy(require_all, permissions, policies)
+
+
+def all_of(*requirements):
+    return _policy(True, requirements)
+
+
+def any_of(*requirements):
+    if not requirements:
+        raise ValueError('any_of() needs at least one permission')
+    return _policy(False, requirements)
+
+
+def compile_permission(permission):
+    '''
+    turns the argument of requires_auth() - a permission string or a
+    policy - into a PermissionPolicy
+    '''
+    if isinstance(permission, PermissionPolicy):
+        return permission
+    return all_of(permission)
+
+
+'''
+TokenPayload
+the decoded jwt payload, a dict that also remembers its permissions as a
+frozenset. Payloads are kept by the verified-token cache, so the set is
+built once per token rather than once per request.
+'''
+
+
+class TokenPayload(dict):
+    _granted = None
+
+    @property
+    def granted_permissions(self):
+        if self._granted is None:
+            self._granted = frozenset(self.get('permissions') or ())
+        return self._granted
+
 '''
 @TODO implement check_permissions(permission, payload) method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        permission: string permission (i.e. 'post:drink') or a
+            PermissionPolicy (i.e. any_of('post:drinks', 'patch:drinks'))
         payload: decoded jwt payload
 
     it should raise an AuthError if permissions are not included in the payload
@@ -86,7 +189,11 @@ def check_permissions(permission, payload):
             'description': 'Authorization token is missing permissions.'
         }, 401)
 
-    if permission not in payload['permissions']:
+    if not isinstance(payload, TokenPayload):
+        payload = TokenPayload(payload)
+
+    if not compile_permission(permission).allows(
+            payload.granted_permissions):
         raise AuthError({
             'code': 'insufficient_permission',
             'description': 'Insufficient permission to view this content.'
@@ -112,26 +219,123 @@ def check_permissions(permission, payload):
 '''
 
 
+class JWKSCache:
+    '''
+    Process-wide cache of the signing keys published at a JWKS url, keyed
+    by kid.
+
+    Only the very first lookup waits for the network. Afterwards the keys
+    are refreshed by a background thread every ttl seconds, and a failed
+    fetch keeps serving the previous (stale) keys. An unknown kid forces a
+    refetch, at most once every min_refetch_interval seconds, so tokens
+    signed with a freshly rotated key are accepted without letting bogus
+    kids hammer the endpoint.
+    '''
+
+    def __init__(self, url, ttl=JWKS_TTL,
+                 min_refetch_interval=JWKS_MIN_REFETCH_INTERVAL,
+                 timeout=JWKS_FETCH_TIMEOUT):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.keys = {}
+        self.fetched_at = None
+        self.last_forced_fetch = None
+        self._lock = threading.Lock()
+        # serializes the initial load, which is the only fetch callers wait on
+        self._start_lock = threading.Lock()
+        self._refresher = None
+        self._stopped = threading.Event()
+
+    def fetch(self):
+        with urlopen(self.url, timeout=self.timeout) as jsonurl:
+            jwks = json.loads(jsonurl.read())
+        return {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks['keys']
+        }
+
+    def refresh(self):
+        '''Refetches the keys, keeping the current ones if that fails.'''
+        # fetch without the lock, requests must not queue behind the network
+        try:
+            keys = self.fetch()
+        except Exception:
+            logger.exception('Unable to fetch JWKS from %s', self.url)
+            return False
+        with self._lock:
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+        return True
+
+    def get_key(self, kid):
+        if self._refresher is None:
+            self.start()
+
+        key = self.keys.get(kid)
+        if key is None and self._may_force_refetch():
+            self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+    def start(self):
+        '''Loads the keys once and keeps them fresh in the background.'''
+        with self._start_lock:
+            if self._refresher is not None:
+                return
+            self.refresh()
+            self.last_forced_fetch = time.monotonic()
+            self._refresher = threading.Thread(
+                target=self._refresh_forever,
+                name='jwks-refresh',
+                daemon=True
+            )
+            self._refresher.start()
+
+    def _may_force_refetch(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_forced_fetch < self.min_refetch_interval:
+                return False
+            self.last_forced_fetch = now
+            return True
+
+    def stop(self):
+        self._stopped.set()
+
+    def _refresh_forever(self):
+        # retry a failed initial fetch sooner than the regular ttl
+        while not self._stopped.wait(
+                self.ttl if self.fetched_at is not None
+                else min(self.ttl, self.min_refetch_interval)):
+            self.refresh()
+
+
+jwks_cache = JWKSCache(JWKS_URL)
+
+
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    if rsa_key is None and not jwks_cache.keys:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to load the signing keys.'
+        }, 503)
+
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -142,7 +346,7 @@ def verify_decode_jwt(token):
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
 
-            return payload
+            return TokenPayload(payload)
 
         except jwt.ExpiredSignatureError:
             raise AuthError({
@@ -167,10 +371,63 @@ def verify_decode_jwt(token):
             }, 400)
 
 
+class VerifiedTokenCache:
+    '''
+    Bounded, thread-safe LRU cache of the payloads of tokens that passed
+    verify_decode_jwt(), keyed by the SHA-256 digest of the token so raw
+    tokens are never kept. An entry is dropped once the token's exp has
+    passed; tokens without exp are not cached. Cached payloads are shared
+    between requests and must be treated as read-only.
+    '''
+
+    def __init__(self, max_size=TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        digest = self.digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[1] <= time.time():
+                del self._entries[digest]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, token, payload):
+        expires_at = payload.get('exp')
+        if not self.max_size or not isinstance(expires_at, (int, float)):
+            return
+        digest = self.digest(token)
+        with self._lock:
+            self._entries[digest] = (payload, expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = VerifiedTokenCache()
+
+
 '''
 @TODO implement @requires_auth(permission) decorator method
     @INPUTS
-        permission: string permission (i.e. 'post:drink')
+        permission: string permission (i.e. 'post:drink') or a
+            PermissionPolicy, compiled once when the view is decorated
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
@@ -182,12 +439,17 @@ def verify_decode_jwt(token):
 
 
 def requires_auth(permission=''):
+    policy = compile_permission(permission)
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.put(token, payload)
+            check_permissions(policy, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
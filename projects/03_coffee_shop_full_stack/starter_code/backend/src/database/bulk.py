@@ -0,0 +1,221 @@
+import json
+import os
+import time
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, bump_drink_menu_version, drink_rows, Drink
+
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 500))
+# at most this many row errors are listed in an import report
+MAX_IMPORT_ERRORS = 100
+# times a batch is rewritten after a concurrent insert of one of its titles
+IMPORT_CONFLICT_RETRIES = 3
+TITLE_MAX_LENGTH = 80
+RECIPE_MAX_LENGTH = 180
+
+'''
+RECIPE_SCHEMA
+the fields of every recipe ingredient and the types they accept
+'''
+RECIPE_SCHEMA = {
+    'color': str,
+    'name': str,
+    'parts': (int, float),
+}
+
+
+'''
+compile_recipe_schema(schema)
+    turns a {field: type(s)} ingredient schema into a function validating a
+    whole recipe: a non-empty list of ingredients (a single ingredient
+    object is wrapped in a list) with exactly the schema's fields.
+    the validator returns the recipe as a list or raises ValueError
+'''
+def compile_recipe_schema(schema):
+    fields = tuple(schema.items())
+    names = frozenset(schema)
+
+    def validate(recipe):
+        if isinstance(recipe, dict):
+            recipe = [recipe]
+        if not isinstance(recipe, list) or not recipe:
+            raise ValueError('recipe must be a non-empty list of ingredients')
+        for position, ingredient in enumerate(recipe, 1):
+            if not isinstance(ingredient, dict):
+                raise ValueError(
+                    'ingredient {} must be an object'.format(position))
+            if ingredient.keys() != names:
+                raise ValueError('ingredient {} must have the fields {}'.format(
+                    position, ', '.join(sorted(names))))
+            for name, types in fields:
+                value = ingredient[name]
+                if not isinstance(value, types) or isinstance(value, bool):
+                    raise ValueError('ingredient {} has an invalid {}'.format(
+                        position, name))
+        return recipe
+
+    return validate
+
+
+validate_recipe = compile_recipe_schema(RECIPE_SCHEMA)
+
+
+'''
+validate_drink(row)
+    returns the (title, recipe) of an imported drink or raises ValueError
+'''
+def validate_drink(row):
+    if not isinstance(row, dict):
+        raise ValueError('not an object')
+    title = row.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError('missing title')
+    title = title.strip()
+    if len(title) > TITLE_MAX_LENGTH:
+        raise ValueError('title longer than {} characters'.format(
+            TITLE_MAX_LENGTH))
+
+    recipe = validate_recipe(row.get('recipe'))
+    if not Drink.__table__.c.recipe.type.native_json and \
+            len(json.dumps(recipe)) > RECIPE_MAX_LENGTH:
+        raise ValueError('recipe longer than {} characters'.format(
+            RECIPE_MAX_LENGTH))
+    return title, recipe
+
+
+'''
+DrinkImport
+imports drinks from NDJSON lines, one {"title": ..., "recipe": [...]}
+object per line
+    valid drinks are written in batches of batch_size, one transaction per
+    batch. a drink whose title exists already gets the imported recipe
+    (upsert on the unique title), and when a title appears twice the later
+    row wins. a batch that collides with a drink inserted concurrently is
+    written again, updating that drink. invalid rows are skipped and reported with their line number
+    EXAMPLE
+        report = DrinkImport().run(open('drinks.ndjson'))
+'''
+class DrinkImport:
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self._batch = {}
+        self._start = time.perf_counter()
+
+    def run(self, lines):
+        for row_number, line in enumerate(lines, 1):
+            if line.strip():
+                self.add(row_number, line)
+        self.flush()
+        return self.report()
+
+    def add(self, row_number, line):
+        try:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError('invalid JSON')
+            title, recipe = validate_drink(row)
+        except ValueError as error:
+            self.fail(row_number, str(error))
+            return
+
+        self._batch.pop(title, None)
+        self._batch[title] = (row_number, recipe)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        try:
+            for retry in range(IMPORT_CONFLICT_RETRIES + 1):
+                try:
+                    created, updated = self.write_batch()
+                    break
+                except IntegrityError:
+                    # a title was inserted since it was looked up: look the
+                    # titles up again, which turns that row into an update
+                    db.session.rollback()
+                    if retry == IMPORT_CONFLICT_RETRIES:
+                        raise
+            self.created += created
+            self.updated += updated
+        except Exception as error:
+            db.session.rollback()
+            for row_number, _ in self._batch.values():
+                self.fail(row_number, 'not saved: {}'.format(
+                    str(error).splitlines()[0]))
+        finally:
+            self._batch = {}
+
+    '''
+    existing_ids(titles)
+        maps the titles that exist already to their drink ids
+    '''
+    def existing_ids(self, titles):
+        return dict(
+            db.session.query(Drink.title, Drink.id)
+            .filter(Drink.title.in_(titles))
+        )
+
+    '''
+    write_batch()
+        inserts the new drinks and updates the existing ones of the batch
+        in one transaction. returns (created, updated)
+    '''
+    def write_batch(self):
+        table = Drink.__table__
+        existing = self.existing_ids(list(self._batch))
+        inserts = [{'title': title, 'recipe': recipe}
+                   for title, (_, recipe) in self._batch.items()
+                   if title not in existing]
+        updates = [{'drink_id': existing[title], 'new_recipe': recipe}
+                   for title, (_, recipe) in self._batch.items()
+                   if title in existing]
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+        if updates:
+            db.session.execute(
+                table.update()
+                .where(table.c.id == bindparam('drink_id'))
+                .values(recipe=bindparam('new_recipe')),
+                updates)
+        bump_drink_menu_version()
+        db.session.commit()
+        return len(inserts), len(updates)
+
+    def fail(self, row_number, error):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'row': row_number, 'error': error})
+
+    def report(self):
+        seconds = time.perf_counter() - self._start
+        imported = self.created + self.updated
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(imported / seconds) if seconds else 0
+        }
+
+
+'''
+drinks_ndjson()
+    generates every drink in its long form, one JSON object per line,
+    reading batch_size rows at a time
+'''
+def drinks_ndjson(batch_size=1000):
+    for id, title, recipe in drink_rows(batch_size):
+        if not isinstance(recipe, str):
+            recipe = json.dumps(recipe)
+        yield '{{"id": {}, "title": {}, "recipe": {}}}\n'.format(
+            id, json.dumps(title), recipe)
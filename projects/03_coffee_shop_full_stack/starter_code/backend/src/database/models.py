@@ -1,23 +1,88 @@
+import hashlib
 import os
-from sqlalchemy import Column, String, Integer
+import threading
+from sqlalchemy import Column, DDL, String, Integer, JSON, event, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.types import TypeDecorator
 from flask_sqlalchemy import SQLAlchemy
 import json
 
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
-database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
+database_path = os.getenv(
+    'DATABASE_URL',
+    "sqlite:///{}".format(os.path.join(project_dir, database_filename))
+)
+# milliseconds a SQLite connection waits for a lock before failing with
+# "database is locked"
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', 30000))
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 8))
+SQLITE_MAX_OVERFLOW = int(os.getenv('SQLITE_MAX_OVERFLOW', 8))
+# applied to every new SQLite connection: WAL lets readers run alongside
+# the writer, and synchronous=NORMAL is durable in WAL mode except for
+# the last commits before a power loss
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': SQLITE_BUSY_TIMEOUT,
+}
+# store recipes in a native JSON column (JSONB on postgres) instead of text
+RECIPE_NATIVE_JSON = os.getenv('RECIPE_NATIVE_JSON', '').lower() in ('1', 'true', 'yes')
 
 db = SQLAlchemy()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database defaults to src/database/database.db and can be set with
+    the DATABASE_URL environment variable. SQLite database files get the
+    tuned engine_options() and SQLITE_PRAGMAS unless tune_sqlite is False.
+    creates the drink_menu_version table if the database predates it
 '''
-def setup_db(app):
+def setup_db(app, database_path=database_path, tune_sqlite=True):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    options = engine_options(database_path) if tune_sqlite else {}
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
     db.app = app
     db.init_app(app)
+    with app.app_context():
+        engine = db.get_engine()
+        if options:
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+        DrinkMenuVersion.__table__.create(bind=engine, checkfirst=True)
+        with engine.begin() as connection:
+            connection.execute(SEED_DRINK_MENU_VERSION)
+
+'''
+engine_options(database_path)
+    a pool of connections shared between threads for SQLite database
+    files; in-memory databases and other backends keep the defaults
+'''
+def engine_options(database_path):
+    url = make_url(database_path)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'poolclass': QueuePool,
+        'pool_size': SQLITE_POOL_SIZE,
+        'max_overflow': SQLITE_MAX_OVERFLOW,
+        'connect_args': {'check_same_thread': False},
+    }
+
+
+'''
+set_sqlite_pragmas()
+    connect hook applying SQLITE_PRAGMAS to new connections, registered by
+    setup_db() on the engine of a tuned SQLite database file only
+'''
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
 
 '''
 db_drop_and_create_all()
@@ -28,6 +93,38 @@ db_drop_and_create_all()
 def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
+    drink_menu_cache.invalidate()
+
+'''
+RecipeType
+column type of Drink.recipe
+    stores the recipe as a JSON string in a String(180) column, or in a
+    native JSON column when native_json is set. Either way it accepts the
+    recipe as a JSON string or as a list when written. Native JSON
+    columns hand back the decoded list, so no json.loads is needed.
+'''
+class RecipeType(TypeDecorator):
+    impl = String(180)
+    cache_ok = True
+
+    def __init__(self, native_json=RECIPE_NATIVE_JSON):
+        super().__init__()
+        self.native_json = native_json
+
+    def load_dialect_impl(self, dialect):
+        if not self.native_json:
+            return dialect.type_descriptor(String(180))
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(JSON())
+
+    def process_bind_param(self, value, dialect):
+        if self.native_json:
+            return json.loads(value) if isinstance(value, str) else value
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
 
 '''
 Drink
@@ -40,18 +137,48 @@ class Drink(db.Model):
     title = Column(String(80), unique=True)
     # the ingredients blob - this stores a lazy json blob
     # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe =  Column(String(180), nullable=False)
+    recipe =  Column(RecipeType(), nullable=False)
+
+    '''
+    recipe_data
+        the parsed recipe, decoded at most once per loaded recipe value.
+        the cache remembers the value it was parsed from, so assigning
+        a new recipe (or reloading the row) invalidates it.
+        the returned lists are shared and must not be modified
+    '''
+    @property
+    def recipe_data(self):
+        recipe = self.recipe
+        cached = self.__dict__.get('_recipe_cache')
+        if cached is not None and cached[0] is recipe:
+            return cached[1]
+        parsed = json.loads(recipe) if isinstance(recipe, str) else recipe
+        self._recipe_cache = (recipe, parsed)
+        return parsed
+
+    '''
+    short_recipe
+        the recipe without ingredient names, cached like recipe_data
+    '''
+    @property
+    def short_recipe(self):
+        parsed = self.recipe_data
+        cached = self.__dict__.get('_short_recipe_cache')
+        if cached is not None and cached[0] is parsed:
+            return cached[1]
+        short = [{'color': r['color'], 'parts': r['parts']} for r in parsed]
+        self._short_recipe_cache = (parsed, short)
+        return short
 
     '''
     short()
         short form representation of the Drink model
     '''
     def short(self):
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': self.short_recipe
         }
 
     '''
@@ -62,7 +189,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe_data
         }
 
     '''
@@ -76,6 +203,7 @@ class Drink(db.Model):
     '''
     def insert(self):
         db.session.add(self)
+        bump_drink_menu_version()
         db.session.commit()
 
     '''
@@ -88,6 +216,7 @@ class Drink(db.Model):
     '''
     def delete(self):
         db.session.delete(self)
+        bump_drink_menu_version()
         db.session.commit()
 
     '''
@@ -100,7 +229,163 @@ class Drink(db.Model):
             drink.update()
     '''
     def update(self):
+        bump_drink_menu_version()
         db.session.commit()
 
     def __repr__(self):
-        return json.dumps(self.short())
\ No newline at end of file
+        return json.dumps(self.short())
+
+
+'''
+drink_rows()
+    the drinks as plain (id, title, recipe) tuples, ordered by id and
+    fetched batch_size rows at a time, without building Drink objects
+'''
+def drink_rows(batch_size=1000):
+    return (
+        db.session.query(Drink.id, Drink.title, Drink.recipe)
+        .order_by(Drink.id)
+        .yield_per(batch_size)
+    )
+
+
+'''
+drinks_json(form)
+    generates the {"success": true, "drinks": [...]} listing in chunks
+    from drink_rows(), with each drink in the same 'short' or 'long' form
+    as drink.short() and drink.long()
+    long recipes stored as text are copied into the output as they are,
+    since they were written as JSON
+'''
+def drinks_json(form='short', batch_size=1000):
+    yield '{"success": true, "drinks": ['
+    separator = ''
+    for id, title, recipe in drink_rows(batch_size):
+        if form == 'long':
+            if not isinstance(recipe, str):
+                recipe = json.dumps(recipe)
+        else:
+            if isinstance(recipe, str):
+                recipe = json.loads(recipe)
+            recipe = json.dumps([{'color': r['color'], 'parts': r['parts']}
+                                 for r in recipe])
+        yield '{}{{"id": {}, "title": {}, "recipe": {}}}'.format(
+            separator, id, json.dumps(title), recipe)
+        separator = ', '
+    yield ']}'
+
+
+'''
+DrinkMenuVersion
+a single row counting the writes to the drinks table
+    it lives in the database so that every worker process sees a write
+    made by any of them. the row is created along with the table, and by
+    setup_db() in databases that have the table without the row
+'''
+class DrinkMenuVersion(db.Model):
+    __tablename__ = 'drink_menu_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+SEED_DRINK_MENU_VERSION = DDL(
+    'INSERT INTO drink_menu_version (id, version) SELECT 0, 0 '
+    'WHERE NOT EXISTS (SELECT 1 FROM drink_menu_version WHERE id = 0)'
+)
+event.listen(DrinkMenuVersion.__table__, 'after_create',
+             SEED_DRINK_MENU_VERSION)
+
+
+'''
+bump_drink_menu_version()
+    increments the menu version in the current transaction, so it is
+    committed (or rolled back) together with the drink writes
+'''
+def bump_drink_menu_version():
+    table = DrinkMenuVersion.__table__
+    db.session.execute(
+        table.update().where(table.c.id == 0)
+        .values(version=table.c.version + 1)
+    )
+
+
+'''
+drink_menu_version()
+    the committed menu version, one primary key lookup. None when the
+    version row is missing, in which case no cached menu is trusted
+'''
+def drink_menu_version():
+    table = DrinkMenuVersion.__table__
+    return db.session.execute(
+        select([table.c.version]).where(table.c.id == 0)
+    ).scalar()
+
+
+'''
+DrinkMenuCache
+per-process cache of the public GET /drinks response body and its ETag
+    the body is built by drinks_json() and kept along with the
+    drink_menu_version() it was built at. every get() reads the version
+    from the database and rebuilds the body when it has moved on, so a
+    write handled by another worker process is seen by the next request
+    and an old ETag is never answered with 304. the version is read before
+    the body, so a concurrent write can only cause an extra rebuild. the
+    ETag is a hash of the body, so every worker process hands out the same
+    ETag for the same menu
+'''
+class DrinkMenuCache:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self._entry = None
+
+    '''
+    get()
+        returns the (body, etag) pair of the current menu
+    '''
+    def get(self):
+        version = drink_menu_version()
+        with self._lock:
+            entry = self._entry
+            if entry is not None and version is not None and \
+                    entry[0] == version:
+                self.hits += 1
+                return entry[1:]
+            self.misses += 1
+
+        body = ''.join(drinks_json('short')).encode()
+        entry = (version, body, hashlib.sha256(body).hexdigest())
+
+        with self._lock:
+            self._entry = entry
+        return entry[1:]
+
+    '''
+    invalidate()
+        drops this process's cached menu, e.g. after the tables were
+        recreated and the version started over
+    '''
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        requests = self.hits + self.misses
+        entry = self._entry
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_ratio': self.hits / requests if requests else None,
+            'version': entry[0] if entry is not None else None
+        }
+
+
+drink_menu_cache = DrinkMenuCache()
@@ -0,0 +1,211 @@
+import json
+import os
+import unittest
+
+# keep the tests away from src/database/database.db
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from src.api import app
+from src.auth import auth
+from src.auth.auth import JWKSCache
+from src.database.models import (
+    db, bump_drink_menu_version, Drink, DrinkMenuVersion, drink_menu_cache
+)
+from test_auth import StubJWKSServer, make_token
+
+
+class DrinkMenuTestCase(unittest.TestCase):
+    """This class represents the public drink menu test case"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        drink_menu_cache.invalidate()
+        self.client = app.test_client()
+        self.add_drink('water', 'blue')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_drink(self, title, color):
+        drink = Drink(title=title, recipe=json.dumps(
+            [{'color': color, 'name': title, 'parts': 1}]))
+        drink.insert()
+        return drink
+
+    def test_get_drinks(self):
+        res = self.client.get('/drinks')
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['drinks'], [{
+            'id': 1, 'title': 'water',
+            'recipe': [{'color': 'blue', 'parts': 1}]
+        }])
+        self.assertIsNotNone(res.get_etag()[0])
+        self.assertFalse(res.get_etag()[1])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get('/drinks').get_etag()[0]
+        not_modified = drink_menu_cache.not_modified
+
+        res = self.client.get('/drinks', headers={
+            'If-None-Match': '"{}"'.format(etag)})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(drink_menu_cache.not_modified, not_modified + 1)
+
+    def test_writes_invalidate_menu(self):
+        etag = self.client.get('/drinks').get_etag()[0]
+        drink = self.add_drink('coffee', 'brown')
+
+        res = self.client.get('/drinks', headers={
+            'If-None-Match': '"{}"'.format(etag)})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.get_json()['drinks']), 2)
+
+        drink.title = 'espresso'
+        drink.update()
+        self.assertIn('espresso', self.client.get('/drinks').get_json()[
+            'drinks'][1]['title'])
+
+        drink.delete()
+        self.assertEqual(self.client.get('/drinks').get_data(),
+                         drink_menu_cache.get()[0])
+        self.assertEqual(len(self.client.get('/drinks').get_json()['drinks']),
+                         1)
+
+    def test_write_by_another_worker_invalidates_menu(self):
+        etag = self.client.get('/drinks').get_etag()[0]
+
+        # what another process does: it shares the database, not the cache
+        table = Drink.__table__
+        db.session.execute(table.update().values(title='tap water'))
+        bump_drink_menu_version()
+        db.session.commit()
+
+        res = self.client.get('/drinks', headers={
+            'If-None-Match': '"{}"'.format(etag)})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['drinks'][0]['title'], 'tap water')
+
+    def test_menu_rebuilt_without_version_row(self):
+        db.session.execute(DrinkMenuVersion.__table__.delete())
+        db.session.commit()
+        self.client.get('/drinks')
+        misses = drink_menu_cache.misses
+
+        self.add_drink('coffee', 'brown')
+        res = self.client.get('/drinks')
+
+        self.assertEqual(len(res.get_json()['drinks']), 2)
+        self.assertEqual(drink_menu_cache.misses, misses + 1)
+
+    def test_metrics_report_hit_ratio(self):
+        drink_menu_cache.hits = drink_menu_cache.misses = 0
+        for _ in range(4):
+            self.client.get('/drinks')
+
+        res = self.client.get('/metrics')
+        stats = res.get_json()['drink_menu_cache']
+
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['hit_ratio'], 0.75)
+
+    def auth_headers(self, permissions=('get:drinks-detail',)):
+        if not hasattr(self, 'jwks_server'):
+            self.jwks_server = StubJWKSServer()
+            self.addCleanup(self.jwks_server.stop)
+            cache = JWKSCache(self.jwks_server.url)
+            self.addCleanup(cache.stop)
+            self.addCleanup(setattr, auth, 'jwks_cache', auth.jwks_cache)
+            auth.jwks_cache = cache
+        return {'Authorization': 'Bearer ' + make_token(
+            permissions=permissions)}
+
+    def test_get_drinks_detail_streams_long_form(self):
+        res = self.client.get('/drinks-detail', headers=self.auth_headers())
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.get_json()['drinks'], [{
+            'id': 1, 'title': 'water',
+            'recipe': [{'color': 'blue', 'name': 'water', 'parts': 1}]
+        }])
+
+
+    def import_drinks(self, rows, permissions=('post:drinks', 'patch:drinks')):
+        body = '\n'.join(
+            row if isinstance(row, str) else json.dumps(row) for row in rows)
+        return self.client.post('/drinks/import', data=body,
+                                headers=self.auth_headers(permissions))
+
+    def test_import_drinks(self):
+        coffee = [{'color': 'brown', 'name': 'coffee', 'parts': 1}]
+        etag = self.client.get('/drinks').get_etag()[0]
+
+        res = self.import_drinks([
+            {'title': 'coffee', 'recipe': coffee},
+            {'title': 'water', 'recipe': {'color': 'clear', 'name': 'water',
+                                          'parts': 2}},
+            {'title': 'tea', 'recipe': [{'color': 'green', 'parts': 1}]},
+            'not json',
+            {'title': 'coffee', 'recipe': coffee * 2},
+        ])
+        data = res.get_json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual((data['created'], data['updated'], data['failed']),
+                         (1, 1, 2))
+        self.assertEqual(data['errors'], [
+            {'row': 3, 'error': 'ingredient 1 must have the fields '
+                                'color, name, parts'},
+            {'row': 4, 'error': 'invalid JSON'},
+        ])
+        self.assertEqual(Drink.query.filter_by(title='coffee').one().long()[
+            'recipe'], coffee * 2)
+        self.assertEqual(
+            Drink.query.filter_by(title='water').one().short()['recipe'],
+            [{'color': 'clear', 'parts': 2}])
+        res = self.client.get('/drinks', headers={
+            'If-None-Match': '"{}"'.format(etag)})
+        self.assertEqual(res.status_code, 200)
+
+    def test_import_drinks_requires_both_permissions(self):
+        res = self.import_drinks([], permissions=('post:drinks',))
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_export_drinks_streams_ndjson(self):
+        self.add_drink('coffee', 'brown')
+
+        res = self.client.get('/drinks/export', headers=self.auth_headers())
+
+        self.assertTrue(res.is_streamed)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        drinks = [json.loads(line) for line in res.get_data(True).splitlines()]
+        self.assertEqual([drink['title'] for drink in drinks],
+                         ['water', 'coffee'])
+        self.assertEqual(drinks[1]['recipe'][0]['name'], 'coffee')
+
+    def test_export_import_commands_round_trip(self):
+        runner = app.test_cli_runner()
+        exported = runner.invoke(args=['export-drinks']).output
+        Drink.query.get(1).delete()
+
+        result = runner.invoke(args=['import-drinks', '-'], input=exported)
+
+        self.assertIn('1 created, 0 updated, 0 failed', result.output)
+        self.assertEqual(Drink.query.one().short()['recipe'],
+                         [{'color': 'blue', 'parts': 1}])
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,347 @@
+import base64
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from Crypto.PublicKey import RSA
+from flask import Flask, jsonify
+from jose import jwt
+
+from src.auth import auth
+from src.auth.auth import (
+    AuthError, JWKSCache, TokenPayload, VerifiedTokenCache, all_of, any_of,
+    check_permissions, requires_auth, verify_decode_jwt
+)
+
+# throwaway key pair, generated for each test run and only ever used to
+# sign tokens in these tests
+TEST_KEY = RSA.generate(2048)
+TEST_PRIVATE_KEY = TEST_KEY.exportKey('PEM').decode()
+
+
+def base64url_uint(value):
+    return base64.urlsafe_b64encode(
+        value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    ).rstrip(b'=').decode()
+
+
+def public_jwk(kid):
+    # built from the key numbers, python-jose 1.3 keys have no to_dict()
+    return {
+        'kty': 'RSA',
+        'kid': kid,
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': base64url_uint(TEST_KEY.n),
+        'e': base64url_uint(TEST_KEY.e)
+    }
+
+
+def make_token(kid='test-key', permissions=('get:drinks-detail',),
+               expires_in=3600):
+    claims = {
+        'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+        'aud': auth.API_AUDIENCE,
+        'sub': 'auth0|tester',
+        'exp': int(time.time()) + expires_in,
+        'permissions': list(permissions),
+    }
+    return jwt.encode(claims, TEST_PRIVATE_KEY, algorithm='RS256',
+                      headers={'kid': kid})
+
+
+class StubJWKSServer(HTTPServer):
+    """Local stand-in for the Auth0 /.well-known/jwks.json endpoint"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubJWKSHandler)
+        self.kids = ['test-key']
+        self.failing = False
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/.well-known/jwks.json'.format(
+            self.server_port)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubJWKSHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.failing:
+            self.send_error(503)
+            return
+        body = json.dumps({
+            'keys': [public_jwk(kid) for kid in self.server.kids]
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """This class represents the JWKS cache test case"""
+
+    def setUp(self):
+        self.server = StubJWKSServer()
+        self.cache = self.use_cache(JWKSCache(self.server.url))
+
+    def tearDown(self):
+        self.cache.stop()
+        self.server.stop()
+
+    def use_cache(self, cache):
+        original = auth.jwks_cache
+        auth.jwks_cache = cache
+        self.addCleanup(setattr, auth, 'jwks_cache', original)
+        return cache
+
+    def test_keys_fetched_once(self):
+        for _ in range(5):
+            payload = verify_decode_jwt(make_token())
+            self.assertEqual(payload['sub'], 'auth0|tester')
+
+        self.assertEqual(self.server.requests, 1)
+
+    def test_unknown_kid_forces_rate_limited_refetch(self):
+        self.cache.min_refetch_interval = 0
+        verify_decode_jwt(make_token())
+        self.server.kids.append('rotated-key')
+
+        payload = verify_decode_jwt(make_token(kid='rotated-key'))
+        self.assertEqual(payload['sub'], 'auth0|tester')
+        self.assertEqual(self.server.requests, 2)
+
+        self.cache.min_refetch_interval = 60
+        for _ in range(3):
+            with self.assertRaises(AuthError) as context:
+                verify_decode_jwt(make_token(kid='bogus-key'))
+            self.assertEqual(context.exception.status_code, 400)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_stale_keys_served_when_fetch_fails(self):
+        verify_decode_jwt(make_token())
+        self.server.failing = True
+
+        self.assertFalse(self.cache.refresh())
+        payload = verify_decode_jwt(make_token())
+        self.assertEqual(payload['sub'], 'auth0|tester')
+
+    def test_background_refresh(self):
+        cache = self.use_cache(JWKSCache(self.server.url, ttl=0.05))
+        self.addCleanup(cache.stop)
+        verify_decode_jwt(make_token())
+        self.server.kids = ['rotated-key']
+
+        deadline = time.monotonic() + 5
+        while 'rotated-key' not in cache.keys and \
+                time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(list(cache.keys), ['rotated-key'])
+
+    def test_slow_refresh_does_not_block_lookups(self):
+        verify_decode_jwt(make_token())
+        fetch = self.cache.fetch
+        release = threading.Event()
+
+        def slow_fetch():
+            release.wait(5)
+            return fetch()
+        self.cache.fetch = slow_fetch
+        refresher = threading.Thread(target=self.cache.refresh)
+        refresher.start()
+        self.addCleanup(refresher.join)
+        self.addCleanup(release.set)
+
+        start = time.monotonic()
+        self.assertIsNone(self.cache.get_key('unknown-key'))
+        self.assertIsNotNone(self.cache.get_key('test-key'))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_503_when_keys_never_loaded(self):
+        self.server.failing = True
+
+        with self.assertRaises(AuthError) as context:
+            verify_decode_jwt(make_token())
+        self.assertEqual(context.exception.status_code, 503)
+
+
+def create_test_app():
+    app = Flask(__name__)
+
+    @app.route('/drinks-detail')
+    @requires_auth('get:drinks-detail')
+    def drinks_detail(payload):
+        return jsonify({'success': True, 'sub': payload['sub']})
+
+    @app.errorhandler(AuthError)
+    def auth_error(error):
+        return jsonify({
+            'success': False,
+            'error': error.status_code,
+            'message': error.error['description']
+        }), error.status_code
+
+    return app
+
+
+class VerifiedTokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified-token cache test case"""
+
+    def setUp(self):
+        self.server = StubJWKSServer()
+        self.jwks_cache = JWKSCache(self.server.url)
+        self.token_cache = VerifiedTokenCache(max_size=2)
+        for name in ('jwks_cache', 'token_cache'):
+            self.addCleanup(setattr, auth, name, getattr(auth, name))
+        auth.jwks_cache = self.jwks_cache
+        auth.token_cache = self.token_cache
+        self.client = create_test_app().test_client()
+
+        self.verified = 0
+        verify = auth.verify_decode_jwt
+
+        def counting_verify(token):
+            self.verified += 1
+            return verify(token)
+        auth.verify_decode_jwt = counting_verify
+        self.addCleanup(setattr, auth, 'verify_decode_jwt', verify)
+
+    def tearDown(self):
+        self.jwks_cache.stop()
+        self.server.stop()
+
+    def get(self, token):
+        return self.client.get('/drinks-detail', headers={
+            'Authorization': 'Bearer ' + token})
+
+    def test_repeated_token_verified_once(self):
+        token = make_token()
+        for _ in range(5):
+            res = self.get(token)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.get_json()['sub'], 'auth0|tester')
+
+        self.assertEqual(self.verified, 1)
+        self.assertEqual(self.token_cache.hits, 4)
+
+    def test_cached_token_still_checks_permissions(self):
+        token = make_token(permissions=())
+        for _ in range(2):
+            self.assertEqual(self.get(token).status_code, 401)
+
+        self.assertEqual(self.verified, 1)
+
+    def test_invalid_token_not_cached(self):
+        token = make_token()[:-4] + 'AAAA'
+        for _ in range(2):
+            self.assertEqual(self.get(token).status_code, 400)
+
+        self.assertEqual(self.verified, 2)
+        self.assertEqual(len(self.token_cache), 0)
+
+    def test_entry_expires_with_token(self):
+        token = make_token()
+        payload = verify_decode_jwt(token)
+        self.token_cache.put(token, dict(payload, exp=time.time() - 1))
+
+        self.assertIsNone(self.token_cache.get(token))
+        self.assertEqual(len(self.token_cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        tokens = [make_token(expires_in=3600 + i) for i in range(3)]
+        for token in tokens[:2]:
+            self.get(token)
+        self.get(tokens[0])
+        self.get(tokens[2])
+
+        self.assertIsNotNone(self.token_cache.get(tokens[0]))
+        self.assertIsNone(self.token_cache.get(tokens[1]))
+        self.assertIsNotNone(self.token_cache.get(tokens[2]))
+
+    def test_tokens_stored_by_digest(self):
+        token = make_token()
+        self.get(token)
+
+        self.assertEqual(list(self.token_cache._entries),
+                         [VerifiedTokenCache.digest(token)])
+
+
+class PermissionPolicyTestCase(unittest.TestCase):
+    """This class represents the permission policy test case"""
+
+    def assertAllowed(self, permission, granted):
+        payload = TokenPayload(permissions=granted)
+        self.assertTrue(check_permissions(permission, payload))
+
+    def assertDenied(self, permission, granted):
+        payload = TokenPayload(permissions=granted)
+        with self.assertRaises(AuthError) as context:
+            check_permissions(permission, payload)
+        self.assertEqual(context.exception.error['code'],
+                         'insufficient_permission')
+
+    def test_single_permission(self):
+        self.assertAllowed('post:drinks', ['get:drinks', 'post:drinks'])
+        self.assertDenied('post:drinks', ['get:drinks'])
+
+    def test_all_of(self):
+        policy = all_of('post:drinks', 'patch:drinks')
+
+        self.assertAllowed(policy, ['patch:drinks', 'post:drinks'])
+        self.assertDenied(policy, ['post:drinks'])
+        self.assertAllowed(all_of(), [])
+
+    def test_any_of(self):
+        policy = any_of('post:drinks', 'patch:drinks')
+
+        self.assertAllowed(policy, ['patch:drinks'])
+        self.assertDenied(policy, ['get:drinks'])
+        with self.assertRaises(ValueError):
+            any_of()
+
+    def test_nested_policies(self):
+        policy = any_of('admin', all_of('post:drinks', 'delete:drinks'))
+
+        self.assertAllowed(policy, ['admin'])
+        self.assertAllowed(policy, ['delete:drinks', 'post:drinks'])
+        self.assertDenied(policy, ['delete:drinks'])
+
+    def test_missing_permissions_claim(self):
+        with self.assertRaises(AuthError) as context:
+            check_permissions('get:drinks', {'sub': 'auth0|tester'})
+        self.assertEqual(context.exception.error['code'],
+                         'missing_permissions')
+
+    def test_invalid_requirement_rejected_at_decoration(self):
+        with self.assertRaises(TypeError):
+            requires_auth(['post:drinks'])
+
+    def test_permission_set_built_once_per_payload(self):
+        payload = TokenPayload(permissions=['scope:{}'.format(i)
+                                            for i in range(500)])
+        check_permissions('scope:499', payload)
+        granted = payload.granted_permissions
+        check_permissions(any_of('scope:0', 'other'), payload)
+
+        self.assertIs(payload.granted_permissions, granted)
+        self.assertIsInstance(granted, frozenset)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
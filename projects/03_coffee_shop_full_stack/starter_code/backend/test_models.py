@@ -0,0 +1,298 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+# keep the tests away from src/database/database.db
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from src.database.bulk import DrinkImport, compile_recipe_schema
+from src.database.models import (
+    db, setup_db, drinks_json, drink_menu_version, Drink, RecipeType
+)
+
+RECIPE = [{'color': 'blue', 'name': 'water', 'parts': 1}]
+
+
+class DrinkTestCase(unittest.TestCase):
+    """This class represents the drink model test case"""
+    native_json = False
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite://')
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        recipe_column = Drink.__table__.c.recipe
+        original = recipe_column.type
+        recipe_column.type = RecipeType(native_json=self.native_json)
+        self.addCleanup(setattr, recipe_column, 'type', original)
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_drink(self, title='water', recipe=json.dumps(RECIPE)):
+        drink = Drink(title=title, recipe=recipe)
+        drink.insert()
+        return drink.id
+
+    def test_representations(self):
+        drink_id = self.add_drink()
+        db.session.remove()
+        drink = Drink.query.get(drink_id)
+
+        self.assertEqual(drink.long()['recipe'], RECIPE)
+        self.assertEqual(drink.short()['recipe'],
+                         [{'color': 'blue', 'parts': 1}])
+        self.assertEqual(json.loads(repr(drink))['title'], 'water')
+
+    def test_recipe_parsed_once(self):
+        drink = Drink.query.get(self.add_drink())
+
+        self.assertIs(drink.long()['recipe'], drink.long()['recipe'])
+        self.assertIs(drink.short()['recipe'], drink.short()['recipe'])
+
+    def test_assignment_invalidates_parsed_recipe(self):
+        drink_id = self.add_drink()
+        drink = Drink.query.get(drink_id)
+        drink.long()
+
+        drink.recipe = json.dumps([{'color': 'brown', 'name': 'coffee',
+                                    'parts': 3}])
+        self.assertEqual(drink.short()['recipe'],
+                         [{'color': 'brown', 'parts': 3}])
+
+        drink.update()
+        db.session.remove()
+        self.assertEqual(Drink.query.get(drink_id).long()['recipe'][0]['name'],
+                         'coffee')
+
+    def test_drinks_json_matches_orm_representations(self):
+        self.add_drink()
+        self.add_drink('"quoted" coffee', json.dumps(
+            [{'color': 'brown', 'name': 'coffee', 'parts': 2}] * 2))
+
+        drinks = Drink.query.order_by(Drink.id).all()
+        for form in ('short', 'long'):
+            body = json.loads(''.join(drinks_json(form, batch_size=1)))
+            self.assertEqual(body, {
+                'success': True,
+                'drinks': [getattr(drink, form)() for drink in drinks]
+            })
+
+    def test_drinks_json_empty(self):
+        self.assertEqual(json.loads(''.join(drinks_json('long'))),
+                         {'success': True, 'drinks': []})
+
+    def test_import_upserts_on_title(self):
+        self.add_drink()
+        coffee = [{'color': 'brown', 'name': 'coffee', 'parts': 1}]
+        lines = [json.dumps({'title': title, 'recipe': coffee})
+                 for title in ('water', 'coffee', 'latte')]
+
+        report = DrinkImport(batch_size=2).run(lines)
+
+        self.assertEqual((report['created'], report['updated']), (2, 1))
+        db.session.remove()
+        self.assertEqual(
+            [drink.long()['recipe'] for drink in Drink.query.all()],
+            [coffee] * 3)
+
+    def test_import_updates_title_inserted_concurrently(self):
+        self.add_drink()
+        coffee = [{'color': 'brown', 'name': 'coffee', 'parts': 1}]
+        lines = [json.dumps({'title': title, 'recipe': coffee})
+                 for title in ('water', 'latte')]
+
+        class RacingImport(DrinkImport):
+            lookups = 0
+
+            def existing_ids(self, titles):
+                # the first lookup misses 'water', as if it was inserted
+                # right after the titles were read
+                self.lookups += 1
+                if self.lookups == 1:
+                    return {}
+                return super().existing_ids(titles)
+
+        importer = RacingImport()
+        report = importer.run(lines)
+
+        self.assertEqual((report['created'], report['updated']), (1, 1))
+        self.assertEqual((report['failed'], importer.lookups), (0, 2))
+        db.session.remove()
+        self.assertEqual(
+            [drink.long()['recipe'] for drink in Drink.query.all()],
+            [coffee] * 2)
+
+    def test_import_reports_failed_batch(self):
+        lines = [json.dumps({'title': 'water', 'recipe': RECIPE})]
+        db.drop_all()
+
+        report = DrinkImport().run(lines)
+
+        self.assertEqual(report['failed'], 1)
+        self.assertTrue(report['errors'][0]['error'].startswith('not saved'))
+
+
+class RecipeSchemaTestCase(unittest.TestCase):
+    """This class represents the compiled recipe schema test case"""
+
+    def setUp(self):
+        self.validate = compile_recipe_schema({'name': str,
+                                               'parts': (int, float)})
+
+    def assertInvalid(self, recipe, message):
+        with self.assertRaises(ValueError) as context:
+            self.validate(recipe)
+        self.assertEqual(str(context.exception), message)
+
+    def test_valid_recipes(self):
+        self.assertEqual(self.validate({'name': 'milk', 'parts': 0.5}),
+                         [{'name': 'milk', 'parts': 0.5}])
+        self.assertEqual(self.validate([{'name': 'milk', 'parts': 1}] * 2),
+                         [{'name': 'milk', 'parts': 1}] * 2)
+
+    def test_invalid_recipes(self):
+        self.assertInvalid([], 'recipe must be a non-empty list of ingredients')
+        self.assertInvalid('milk',
+                           'recipe must be a non-empty list of ingredients')
+        self.assertInvalid(['milk'], 'ingredient 1 must be an object')
+        self.assertInvalid([{'name': 'milk', 'parts': 1},
+                            {'name': 'milk', 'parts': 1, 'color': 'white'}],
+                           'ingredient 2 must have the fields name, parts')
+        self.assertInvalid([{'name': 'milk', 'parts': '1'}],
+                           'ingredient 1 has an invalid parts')
+        self.assertInvalid([{'name': 'milk', 'parts': True}],
+                           'ingredient 1 has an invalid parts')
+
+
+class NativeJSONDrinkTestCase(DrinkTestCase):
+    """Runs the drink model tests with recipes in a native JSON column"""
+    native_json = True
+
+    def test_recipe_stored_as_json(self):
+        drink_id = self.add_drink(recipe=RECIPE)
+        db.session.remove()
+
+        self.assertEqual(Drink.query.get(drink_id).recipe, RECIPE)
+
+
+class SetupDBTestCase(unittest.TestCase):
+    """This class represents the database setup test case"""
+
+    def test_upgrades_database_without_menu_version(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'old.db')
+        connection = sqlite3.connect(path)
+        connection.execute(
+            'CREATE TABLE drink (id INTEGER NOT NULL, title VARCHAR(80), '
+            'recipe VARCHAR(180) NOT NULL, PRIMARY KEY (id), UNIQUE (title))')
+        connection.close()
+
+        app = Flask(__name__)
+        setup_db(app, 'sqlite:///' + path)
+        setup_db(app, 'sqlite:///' + path)
+
+        with app.app_context():
+            self.assertEqual(drink_menu_version(), 0)
+            Drink(title='water', recipe=json.dumps(RECIPE)).insert()
+            self.assertEqual(drink_menu_version(), 1)
+            db.session.remove()
+            db.get_engine().dispose()
+
+
+def run_writers(app, num_threads, writes_per_thread):
+    '''
+    each thread creates drinks and renames them, reading drinks in
+    between, like concurrent POST, GET and PATCH requests. returns the
+    errors raised
+    '''
+    errors = []
+
+    def writer(thread_id):
+        with app.app_context():
+            try:
+                for i in range(writes_per_thread):
+                    drink = Drink(title='drink {}-{}'.format(thread_id, i),
+                                  recipe=json.dumps(RECIPE))
+                    drink.insert()
+                    [d.short() for d in Drink.query.limit(50)]
+                    drink = Drink.query.get(drink.id)
+                    drink.title = 'renamed ' + drink.title
+                    drink.update()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(thread_id,))
+               for thread_id in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class ConcurrentWritersTestCase(unittest.TestCase):
+    """Stress test of concurrent writers on a SQLite database file"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app = Flask(__name__)
+        setup_db(self.app, 'sqlite:///' + os.path.join(directory, 'test.db'))
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.get_engine().dispose()
+
+    def test_wal_mode_enabled(self):
+        with self.app.app_context():
+            journal_mode = db.session.execute(
+                text('PRAGMA journal_mode')).scalar()
+            synchronous = db.session.execute(
+                text('PRAGMA synchronous')).scalar()
+
+        self.assertEqual(journal_mode, 'wal')
+        self.assertEqual(synchronous, 1)
+
+    def test_other_engines_keep_their_settings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        engine = create_engine(
+            'sqlite:///' + os.path.join(directory, 'other.db'))
+
+        with engine.connect() as connection:
+            journal_mode = connection.execute(
+                text('PRAGMA journal_mode')).scalar()
+        engine.dispose()
+
+        self.assertEqual(journal_mode, 'delete')
+
+    def test_concurrent_writers_without_lock_errors(self):
+        errors = run_writers(self.app, num_threads=8, writes_per_thread=25)
+
+        self.assertEqual(errors, [])
+        with self.app.app_context():
+            self.assertEqual(Drink.query.count(), 200)
+            self.assertEqual(Drink.query.filter(
+                Drink.title.startswith('renamed')).count(), 200)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()